@@ -6,7 +6,7 @@ import re
 import random
 import pandas as pd  # Required for Excel Import
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context
 from pymongo import MongoClient
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
@@ -15,6 +15,7 @@ from dotenv import load_dotenv
 
 # --- CUSTOM MODULES ---
 try:
+    from llm_client import LLMBusyError
     from chatbot_core import get_ai_response, generate_chat_title
     from quiz_core import generate_quiz_ai, grade_quiz_ai
     from summary_core import summarize_content
@@ -89,6 +90,30 @@ def safe_float(value):
     except:
         return 0.0
 
+def sync_staff_directory(staff_id=None, email=None, removed=False):
+    """Keeps the chatbot's cached staff directory in step with admin edits."""
+    try:
+        from chatbot_core import refresh_staff_member, remove_staff_member
+        if removed: remove_staff_member(staff_id)
+        else: refresh_staff_member(staff_id=staff_id, email=email)
+    except Exception as e:
+        print(f"⚠️ Staff directory sync failed: {e}")
+
+def sse_event(data, event=None):
+    """Formats one Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def llm_busy_response(e, **extra):
+    """429/503 with Retry-After when the LLM admission queue rejects a call."""
+    resp = jsonify({"success": False, "error": "Le service IA est surchargé, réessayez dans quelques secondes.", **extra})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, e.status
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # ==============================================================================
 #                                PAGE ROUTES
 # ==============================================================================
@@ -198,10 +223,11 @@ def add_user():
             "major": data.get('major'), "year": data.get('year'), "role": "student"
         })
     else:
-        db.staff.insert_one({
+        res = db.staff.insert_one({
             "full_name": data.get('full_name'), "email": data.get('email'), "password_teacher": hashed_pw,
             "role": "teacher", "department": data.get('major', 'General')
         })
+        sync_staff_directory(staff_id=res.inserted_id)
     return jsonify({"success": True})
 
 @app.route('/api/admin/update_user', methods=['POST'])
@@ -220,13 +246,16 @@ def update_user():
     else:
         updates["department"] = data.get('major')
         db.staff.update_one({"_id": ObjectId(user_id)}, {"$set": updates})
+        sync_staff_directory(staff_id=user_id)
     return jsonify({"success": True})
 
 @app.route('/api/admin/delete_user', methods=['POST'])
 def delete_user():
     if session.get('role') != 'admin': return jsonify({"success": False}), 403
-    collection = db.students if request.json.get('role') == 'student' else db.staff
+    is_student = request.json.get('role') == 'student'
+    collection = db.students if is_student else db.staff
     collection.delete_one({"_id": ObjectId(request.json.get('id'))})
+    if not is_student: sync_staff_directory(staff_id=request.json.get('id'), removed=True)
     return jsonify({"success": True})
 
 @app.route('/api/admin/upload_users', methods=['POST'])
@@ -257,10 +286,37 @@ def upload_users_excel():
                     "department": row.get('department') or row.get('departement'), "role": "teacher"
                 }
                 db.staff.update_one({"email": email}, {"$set": user_doc}, upsert=True)
+                sync_staff_directory(email=email)
             count += 1
         return jsonify({"success": True, "count": count})
     except Exception as e: return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/admin/ai_metrics', methods=['GET'])
+def get_ai_metrics():
+    """Cache/queue counters of the AI layer, for monitoring."""
+    if session.get('role') != 'admin': return jsonify({}), 403
+    from chatbot_core import get_staff_cache_stats, get_staff_prompt_stats, get_title_worker_stats, get_compaction_stats, \
+        get_retrieval_stats
+    from llm_client import get_llm_stats
+    from response_cache import get_cache_stats
+    from rag_utils import get_dedup_stats
+    from ingest_queue import get_ingest_stats
+    from quiz_pool import get_quiz_pool_stats
+    from quiz_store import get_quiz_cache_stats
+    return jsonify({
+        "llm": get_llm_stats(),
+        "response_cache": get_cache_stats(),
+        "staff_directory": get_staff_cache_stats(),
+        "staff_prompt": get_staff_prompt_stats(),
+        "title_workers": get_title_worker_stats(),
+        "compaction_workers": get_compaction_stats(),
+        "retrieval": get_retrieval_stats(),
+        "document_dedup": get_dedup_stats(),
+        "ingestion": get_ingest_stats(),
+        "quiz_pool": get_quiz_pool_stats(),
+        "quiz_cache": get_quiz_cache_stats(),
+    })
+
 @app.route('/api/admin/post_announcement', methods=['POST'])
 def post_announcement():
     if session.get('role') != 'admin': return jsonify({"success": False}), 403
@@ -484,16 +540,31 @@ def submit_attendance():
 @app.route('/api/teacher/upload_material', methods=['POST'])
 def upload_material():
     if session.get('role') not in ['teacher', 'admin']: return jsonify({"success": False}), 403
+    from rag_utils import hash_upload
+    from course_indexer import schedule_course_indexing
+    new_ids = []
     for f in request.files.getlist('files'):
         fn = secure_filename(f.filename)
-        save_name = f"{int(time.time())}_{fn}"
-        f.save(os.path.join(UPLOAD_FOLDER_COURSES, save_name))
-        db.course_materials.insert_one({
+        # Same bytes already on disk (another class, a re-upload): point to that copy.
+        content_hash, size = hash_upload(f)
+        existing = db.course_materials.find_one({"content_hash": content_hash}, {"file_path": 1})
+        reused = bool(existing) and os.path.exists(os.path.join(base_dir, existing['file_path'].lstrip('/')))
+        if reused:
+            file_path = existing['file_path']
+        else:
+            save_name = f"{int(time.time())}_{fn}"
+            f.save(os.path.join(UPLOAD_FOLDER_COURSES, save_name))
+            file_path = f"/static/courses/{save_name}"
+        res = db.course_materials.insert_one({
             "subject": request.form.get('subject'), "major": request.form.get('major'),
             "category": request.form.get('category'), "filename": fn,
-            "file_path": f"/static/courses/{save_name}", "uploaded_by": session.get('user_id'),
-            "teacher_name": session.get('name'), "upload_date": time.time(), "file_type": fn.split('.')[-1].lower()
+            "file_path": file_path, "uploaded_by": session.get('user_id'),
+            "teacher_name": session.get('name'), "upload_date": time.time(), "file_type": fn.split('.')[-1].lower(),
+            "content_hash": content_hash, "size": size, "reused_file": reused
         })
+        new_ids.append(res.inserted_id)
+    # Text extraction + indexing into the GLOBAL search corpus happens in the background.
+    if new_ids: schedule_course_indexing(new_ids)
     return jsonify({"success": True})
 
 @app.route('/api/teacher/get_upload_options', methods=['GET'])
@@ -509,6 +580,27 @@ def get_upload_opts():
             seen.add(key)
     return jsonify(options)
 
+@app.route('/api/teacher/quiz_analytics', methods=['GET'])
+def get_quiz_analytics():
+    """Quiz results per class (subject, major) of the teacher's assignments, or of ?subject=&major=."""
+    if session.get('role') not in ['teacher', 'admin']: return jsonify([]), 403
+    from quiz_attempts import get_class_stats
+    if request.args.get('subject'):
+        pairs = [(request.args.get('subject'), request.args.get('major'))]
+    else:
+        teacher = db.staff.find_one({"_id": ObjectId(session.get('user_id'))}) or {}
+        pairs = list(dict.fromkeys((a.get('subject'), a.get('major')) for a in teacher.get('teaching_assignments', [])))
+    return jsonify(get_class_stats(pairs))
+
+@app.route('/api/teacher/quiz_analytics/<quiz_id>', methods=['GET'])
+def get_quiz_question_analytics(quiz_id):
+    """Success rate of each question of one quiz."""
+    if session.get('role') not in ['teacher', 'admin']: return jsonify({}), 403
+    from quiz_attempts import get_quiz_stats
+    stats = get_quiz_stats(quiz_id)
+    if not stats: return jsonify({"error": "Aucune tentative pour ce quiz."}), 404
+    return jsonify(stats)
+
 # ==============================================================================
 #                                STUDENT APIs
 # ==============================================================================
@@ -642,105 +734,198 @@ def get_student_info():
 #                                AI & CHAT APIs
 # ==============================================================================
 
+def save_chat_turn(sid, uid, msg, resp):
+    """Appends one user/AI exchange to the conversation and returns its title."""
+    from chatbot_core import schedule_chat_title, maybe_schedule_compaction, PLACEHOLDER_TITLE
+    from conversation_store import append_turn
+    turn = append_turn(sid, uid, msg, resp, PLACEHOLDER_TITLE)
+    if turn["is_new"]:
+        # New session: the real title is written back by a background worker.
+        schedule_chat_title(sid, msg, resp)
+    maybe_schedule_compaction(sid, turn["seq"], turn["summary_upto_seq"])
+    return turn["title"]
+
 @app.route('/api/chat', methods=['POST'])
 def chat_api():
     try:
-        from chatbot_core import get_ai_response, generate_chat_title
+        from chatbot_core import get_ai_response
         d = request.json
         sid, msg, uid = d.get('session_id'), d.get('message'), session.get('user_id')
         if not sid: return jsonify({"error": "No Session ID"}), 400
         resp = get_ai_response(msg, sid, uid)
-        db.conversations.update_one({"session_id": sid}, {
-            "$push": {"messages": {"user": msg, "ai": resp, "time": time.time()}},
-            "$set": {"updated_at": time.time(), "user_id": uid},
-            "$setOnInsert": {"created_at": time.time(), "title": generate_chat_title(msg, resp)}
-        }, upsert=True)
-        convo = db.conversations.find_one({"session_id": sid})
-        return jsonify({"response": resp, "title": convo.get('title')})
+        return jsonify({"response": resp, "title": save_chat_turn(sid, uid, msg, resp)})
+    except LLMBusyError as e: return llm_busy_response(e, response="AI Busy")
     except: return jsonify({"response": "AI Unavailable"})
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_api():
+    """
+    Streaming variant of /api/chat (Server-Sent Events).
+    Emits {"token": ...} frames while the model generates, then one
+    'done' event with the full response and the conversation title.
+    """
+    from chatbot_core import stream_ai_response
+    d = request.json or {}
+    sid, msg, uid = d.get('session_id'), d.get('message'), session.get('user_id')
+    if not sid: return jsonify({"error": "No Session ID"}), 400
+
+    def events():
+        parts, saved = [], False
+        try:
+            for token in stream_ai_response(msg, sid, uid):
+                parts.append(token)
+                yield sse_event({"token": token})
+            resp = "".join(parts)
+            title = save_chat_turn(sid, uid, msg, resp)
+            saved = True
+            yield sse_event({"response": resp, "title": title}, event="done")
+        except GeneratorExit:
+            raise
+        except LLMBusyError as e:
+            yield sse_event({"error": "AI Busy", "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            print(f"❌ Chat Stream Error: {e}")
+            yield sse_event({"error": "AI Unavailable"}, event="error")
+        finally:
+            # Client went away mid-stream: keep what was generated so far.
+            if not saved and parts:
+                try: save_chat_turn(sid, uid, msg, "".join(parts))
+                except Exception as e: print(f"❌ Chat Stream Save Error: {e}")
+
+    return sse_response(events())
+
 @app.route('/api/upload', methods=['POST'])
 def upload_chat_file():
+    """Accepts the file for background indexing; poll /api/upload/status/<job_id>."""
+    from ingest_queue import enqueue_upload, IngestBusyError
     try:
-        from rag_utils import index_document
-        if index_document(request.files.get('file'), request.files.get('file').filename, request.form.get('session_id')):
-            return jsonify({"success": True})
+        f = request.files.get('file')
+        job_id = enqueue_upload(f, f.filename, request.form.get('session_id'), session.get('user_id'))
+        return jsonify({"success": True, "job_id": job_id, "status": "queued"}), 202
+    except IngestBusyError as e:
+        resp = jsonify({"success": False, "error": "Trop de fichiers en cours d'analyse, réessayez bientôt."})
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp, 503
     except: pass
     return jsonify({"success": False})
 
+@app.route('/api/upload/status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    from ingest_queue import get_job
+    job = get_job(job_id, session.get('user_id'))
+    if not job: return jsonify({"error": "Job introuvable"}), 404
+    return jsonify(job)
+
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    convos = list(db.conversations.find({"user_id": session.get('user_id')}).sort("updated_at", -1))
+    from conversation_store import list_conversations
+    convos = list_conversations(session.get('user_id'))
     return jsonify([{"session_id": c["session_id"], "title": c.get("title")} for c in convos])
 
 @app.route('/api/load_session/<session_id>', methods=['GET'])
 def load_session(session_id):
-    c = db.conversations.find_one({"session_id": session_id, "user_id": session.get('user_id')})
-    return jsonify({"messages": c.get('messages', []), "title": c.get('title')}) if c else jsonify({})
+    """Latest page of a conversation; pass ?before=<next_cursor> for older messages."""
+    from conversation_store import get_page
+    page = get_page(session_id, session.get('user_id'),
+                    before=request.args.get('before', type=int), limit=request.args.get('limit', type=int))
+    return jsonify(page) if page else jsonify({})
 
 @app.route('/api/reset', methods=['POST'])
 def reset_chat(): return jsonify({"success": True})
 
+def quiz_stream_response(subject, difficulty, language):
+    """
+    SSE mode of /api/quiz/generate: 'start' {quiz_id}, then one 'question'
+    event per question as soon as it is generated (answers stripped, as in
+    get_quiz), then 'done'. Each question is appended to the stored quiz before
+    it is sent, so hints and grading work while the rest is still coming.
+    """
+    from quiz_core import stream_quiz_questions, generate_quiz_ai
+    from quiz_pool import take_quiz
+    from quiz_store import ensure_indexes
+    ensure_indexes()
+    qid = str(uuid.uuid4())
+    db.quizzes.insert_one({"quiz_id": qid, "user_id": session.get('user_id'), "status": "generating",
+                           "content": {"subject": subject, "questions": []}})
+
+    def add(q, index):
+        db.quizzes.update_one({"quiz_id": qid}, {"$push": {"content.questions": q}})
+        return sse_event({"index": index, "question": {k: v for k, v in q.items() if k != 'correct_answer'}}, event="question")
+
+    def events():
+        count = 0
+        yield sse_event({"quiz_id": qid, "subject": subject}, event="start")
+        try:
+            pooled = take_quiz(subject, difficulty, language)
+            questions = pooled['questions'] if pooled else stream_quiz_questions(subject, difficulty, language)
+            try:
+                for q in questions:
+                    yield add(q, count)
+                    count += 1
+            except LLMBusyError:
+                raise
+            except Exception as e:
+                if count: raise
+                print(f"❌ Quiz Stream Error: {e}")
+            if not count:
+                # Nothing usable came out of the stream: same fallback as the JSON mode
+                for q in generate_quiz_ai(subject, difficulty, language).get('questions', []):
+                    yield add(q, count)
+                    count += 1
+            db.quizzes.update_one({"quiz_id": qid}, {"$set": {"status": "ready"}})
+            yield sse_event({"success": True, "quiz_id": qid, "total": count}, event="done")
+        except GeneratorExit:
+            raise
+        except LLMBusyError as e:
+            yield sse_event({"error": "AI Busy", "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            print(f"❌ Quiz Stream Error: {e}")
+            yield sse_event({"error": "AI Unavailable"}, event="error")
+        finally:
+            if count:
+                db.quizzes.update_one({"quiz_id": qid, "status": "generating"}, {"$set": {"status": "ready"}})
+            else:
+                # Failed (or abandoned) before the first question: no empty quiz left behind
+                db.quizzes.delete_one({"quiz_id": qid, "status": "generating"})
+    return sse_response(events())
+
 @app.route('/api/quiz/generate', methods=['POST'])
 def generate_quiz():
+    d = request.json or {}
+    if d.get('stream'):
+        return quiz_stream_response(d.get('subject'), d.get('difficulty'), d.get('language'))
     try:
         from quiz_core import generate_quiz_ai
-        d = request.json
-        content = generate_quiz_ai(d.get('subject'), d.get('difficulty'), d.get('language'))
+        from quiz_pool import take_quiz
+        from quiz_store import save_quiz
+        # Pre-generated quiz if one is ready, live generation otherwise
+        content = take_quiz(d.get('subject'), d.get('difficulty'), d.get('language')) \
+            or generate_quiz_ai(d.get('subject'), d.get('difficulty'), d.get('language'))
         qid = str(uuid.uuid4())
-        db.quizzes.insert_one({"quiz_id": qid, "user_id": session.get('user_id'), "content": content})
+        save_quiz(qid, session.get('user_id'), content)
         return jsonify({"success": True, "quiz_id": qid})
+    except LLMBusyError as e: return llm_busy_response(e)
     except: return jsonify({"success": False})
 
 # --- UPDATED: ROBUST QUIZ LOADING ---
 @app.route('/api/quiz/<quiz_id>', methods=['GET'])
 def get_quiz(quiz_id):
-    q = db.quizzes.find_one({"quiz_id": quiz_id})
+    from quiz_store import get_quiz as load_quiz
+    q = load_quiz(quiz_id)
     if not q: return jsonify({"error": "Quiz introuvable"}), 404
-    
-    content = q.get('content', {})
-
-    # 1. Parse if string (Fix "Expecting ',' delimiter" issue aftermath)
-    if isinstance(content, str):
-        try: content = json.loads(content)
-        except: content = {}
-
-    # 2. Normalize Dict vs List
-    if isinstance(content, dict):
-        questions = content.get('questions', [])
-        subject = content.get('subject', 'Quiz')
-    elif isinstance(content, list):
-        questions = content
-        subject = "Quiz"
-    else:
-        questions = []
-        subject = "Erreur de format"
-
-    # 3. Sanitize
-    safe_questions = []
-    for i in questions:
-        if isinstance(i, dict):
-            safe_q = {k: v for k, v in i.items() if k != 'correct_answer'}
-            safe_questions.append(safe_q)
-
-    return jsonify({"questions": safe_questions, "subject": subject})
+    # Normalized and sanitized (no correct_answer) once, in quiz_store
+    return jsonify({"questions": q['public'], "subject": q['subject']})
 
 # --- UPDATED: ROBUST QUIZ HINT ---
 @app.route('/api/quiz/hint', methods=['POST'])
 def get_quiz_hint():
     try:
+        from quiz_store import get_quiz as load_quiz
         data = request.json
-        quiz = db.quizzes.find_one({"quiz_id": data.get('quiz_id')})
+        quiz = load_quiz(data.get('quiz_id'))
         if not quiz: return jsonify({"hint": "Quiz introuvable."})
-        
-        # Robust content extraction (same as get_quiz)
-        content = quiz.get('content', {})
-        if isinstance(content, str):
-            try: content = json.loads(content)
-            except: content = {}
-            
-        questions = content.get('questions', []) if isinstance(content, dict) else (content if isinstance(content, list) else [])
-        
+        questions = quiz['questions']
+
         idx = int(data.get('index', 0))
         if 0 <= idx < len(questions):
             q = questions[idx]
@@ -755,28 +940,76 @@ def get_quiz_hint():
 @app.route('/api/quiz/submit', methods=['POST'])
 def submit_quiz():
     try:
-        from quiz_core import grade_quiz_ai
-        q = db.quizzes.find_one({"quiz_id": request.form.get('quiz_id')})
-        return jsonify(grade_quiz_ai(q['content'], json.loads(request.form.get('answers'))))
+        from quiz_attempts import record_attempt
+        # Graded, stored in db.quiz_attempts and counted in the class analytics
+        result = record_attempt(request.form.get('quiz_id'), session.get('user_id'), json.loads(request.form.get('answers')))
+        return jsonify(result or {})
     except: return jsonify({})
 
 @app.route('/api/summarize', methods=['POST'])
 def generate_summary_route():
     try:
         from summary_core import summarize_content
-        from rag_utils import extract_text_from_pdf
-        txt = extract_text_from_pdf(request.files['file']) if 'file' in request.files else request.form.get('text','')
-        return jsonify({"success": True, "summary": summarize_content(txt[:30000], request.form.get('type'))})
+        from rag_utils import extract_text_cached
+        txt = extract_text_cached(request.files['file']) if 'file' in request.files else request.form.get('text','')
+        if not txt: return jsonify({"success": False, "error": "Aucun texte à résumer."}), 400
+        return jsonify({"success": True, "summary": summarize_content(txt, request.form.get('type'))})
+    except LLMBusyError as e: return llm_busy_response(e)
     except: return jsonify({"success": False})
 
+def text_stream_response(chunks, result_key, label):
+    """SSE frames {"token": ...} for each chunk, then 'done' with the full text under result_key."""
+    def events():
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event({"token": chunk})
+            yield sse_event({"success": True, result_key: "".join(parts)}, event="done")
+        except GeneratorExit:
+            raise
+        except LLMBusyError as e:
+            yield sse_event({"error": "AI Busy", "retry_after": e.retry_after}, event="error")
+        except Exception as e:
+            print(f"❌ {label} Stream Error: {e}")
+            yield sse_event({"error": "AI Unavailable"}, event="error")
+    return sse_response(events())
+
+@app.route('/api/summarize/stream', methods=['POST'])
+def summary_stream_route():
+    """Streaming variant of /api/summarize (Server-Sent Events)."""
+    from summary_core import stream_summary
+    from rag_utils import extract_text_cached
+    txt = extract_text_cached(request.files['file']) if 'file' in request.files else request.form.get('text','')
+    if not txt: return jsonify({"success": False, "error": "Aucun texte à résumer."}), 400
+    return text_stream_response(stream_summary(txt, request.form.get('type')), "summary", "Summary")
+
 @app.route('/api/plan/generate', methods=['POST'])
 def create_study_plan_route():
     try:
         from planner_core import generate_study_plan
         mats = [m.get('title') for m in db.materials.find({"uploaded_by": session.get('user_id')})]
         return jsonify({"success": True, "plan": generate_study_plan(request.json.get('days'), request.json.get('subjects'), request.json.get('goal'), mats)})
+    except LLMBusyError as e: return llm_busy_response(e)
     except: return jsonify({"success": False})
 
+@app.route('/api/plan/generate/stream', methods=['POST'])
+def study_plan_stream_route():
+    """Streaming variant of /api/plan/generate (Server-Sent Events)."""
+    from planner_core import stream_study_plan
+    d = request.json or {}
+    mats = [m.get('title') for m in db.materials.find({"uploaded_by": session.get('user_id')})]
+    return text_stream_response(stream_study_plan(d.get('days'), d.get('subjects') or [], d.get('goal'), mats),
+                                "plan", "Planner")
+
 if __name__ == '__main__':
+    try:
+        from ingest_queue import resume_pending_jobs
+        resume_pending_jobs()
+    except Exception as e: print(f"⚠️ Could not resume ingestion jobs: {e}")
+    try:
+        from quiz_pool import warm_quiz_pool
+        warm_quiz_pool()
+    except Exception as e: print(f"⚠️ Could not warm the quiz pool: {e}")
     print("🚀 University System Online: http://127.0.0.1:5000")
     app.run(debug=True, use_reloader=False)
\ No newline at end of file
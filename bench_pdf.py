@@ -0,0 +1,93 @@
+import glob
+import os
+import random
+import sys
+import time
+
+# Compares the old extract_text_from_pdf loop (text += page) with the page
+# generator + join-once path and the process-pool page-range mode, on a path
+# and on an open file (uploads, spooled to a temporary file for the workers).
+# The pool is started before timing.
+# Runs on the PDFs under static/; files that are not real PDFs (e.g. git-lfs
+# pointers in a fresh clone) are skipped and a synthetic lecture PDF is used.
+# Usage: python bench_pdf.py [file.pdf ...]
+
+import pypdf
+import rag_utils
+
+random.seed(42)
+WORDS = ("réseau protocole chiffrement attaque vulnérabilité scanner pare-feu serveur "
+         "client cloud machine virtuelle hyperviseur conteneur stockage données").split()
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_synthetic_pdf(path, pages=150, lines=45):
+    """Writes a plain multi-page text PDF (one Helvetica text stream per page)."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        body = "\n".join(f"({_pdf_escape(' '.join(random.choices(WORDS, k=12)))}) Tj T*" for _ in range(lines))
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td\n{body}\nET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1', 'replace'))} >>\nstream\n{stream}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1", "replace")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+def old_extract(path):
+    reader = pypdf.PdfReader(path)
+    text = ""
+    for page in reader.pages:
+        content = page.extract_text()
+        if content:
+            text += content + "\n"
+    return text
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - t0) * 1000
+
+def bench(path):
+    try:
+        pages = len(pypdf.PdfReader(path).pages)
+    except Exception:
+        print(f"   skipped {os.path.basename(path)} (not a readable PDF)")
+        return
+    old, old_ms = timed(old_extract, path)
+    serial, serial_ms = timed(lambda p: "".join(f"{t}\n" for _, t in rag_utils.iter_pdf_pages(p)), path)
+    workers = max(2, rag_utils.PDF_WORKERS)
+    parallel, parallel_ms = timed(lambda p: rag_utils.extract_pages_parallel(p, workers=workers), path)
+    with open(path, "rb") as f:
+        upload, upload_ms = timed(lambda s: rag_utils.extract_pages_parallel(s, workers=workers), f)
+    expected = list(rag_utils.iter_pdf_pages(path))
+    same = serial == old[:len(serial)] and parallel == expected and upload == expected
+    print(f"   {os.path.basename(path)[:40]:40} {pages:>4} p | loop {old_ms:8.1f} ms | generator {serial_ms:8.1f} ms | "
+          f"parallel {parallel_ms:8.1f} ms | upload {upload_ms:8.1f} ms | same text: {same}")
+
+if __name__ == "__main__":
+    files = sys.argv[1:] or sorted(glob.glob(os.path.join(rag_utils.base_dir, "static", "**", "*.pdf"), recursive=True))
+    synthetic = os.path.join(rag_utils.INDEX_DIR, "bench_synthetic.pdf")
+    os.makedirs(rag_utils.INDEX_DIR, exist_ok=True)
+    make_synthetic_pdf(synthetic)
+    rag_utils._get_pdf_pool(max(2, rag_utils.PDF_WORKERS)).submit(int).result()
+    print(f"📊 PDF extraction ({os.cpu_count()} CPUs, PDF_WORKERS={rag_utils.PDF_WORKERS})")
+    try:
+        for path in files + [synthetic]:
+            bench(path)
+    finally:
+        os.remove(synthetic)
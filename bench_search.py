@@ -0,0 +1,52 @@
+import random
+import time
+from search_index import BM25Index, SYSTEM_SCOPE
+
+# Compares the old search_database scan (substring test of every keyword in
+# every document) with the BM25 inverted index on a synthetic corpus.
+# Usage: python bench_search.py
+
+random.seed(42)
+VOCAB = [f"term{i}" for i in range(20000)]
+WEIGHTS = [1 / (i + 1) for i in range(len(VOCAB))]   # Zipf-like word frequencies
+QUERIES = 200
+
+def make_doc(words=400):
+    return " ".join(random.choices(VOCAB, weights=WEIGHTS, k=words))
+
+def linear_scan(docs, query, session_id):
+    keywords = [w.lower() for w in query.split() if len(w) > 3]
+    results = []
+    for doc in docs:
+        if doc["session_id"] not in (session_id, "GLOBAL"):
+            continue
+        content = doc["text_content"].lower()
+        score = sum(1 for k in keywords if k in content)
+        if score > 0:
+            results.append(doc["title"])
+    return results[:2]
+
+def run(corpus_size):
+    docs = [{"title": f"doc{i}", "session_id": random.choice(["GLOBAL", "s1", "s2", "s3"]),
+             "text_content": make_doc()} for i in range(corpus_size)]
+    index = BM25Index()
+    for i, d in enumerate(docs):
+        index.add(str(i), d["text_content"], str(i), {d["session_id"]})
+    queries = [" ".join(random.choices(VOCAB[100:5000], k=4)) for _ in range(QUERIES)]
+
+    t0 = time.perf_counter()
+    for q in queries:
+        linear_scan(docs, q, "s1")
+    scan_ms = (time.perf_counter() - t0) / QUERIES * 1000
+
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search(q, {"s1", "GLOBAL", SYSTEM_SCOPE}, k=2)
+    bm25_ms = (time.perf_counter() - t0) / QUERIES * 1000
+
+    print(f"{corpus_size:>7} docs | scan {scan_ms:8.2f} ms/query | bm25 {bm25_ms:7.3f} ms/query | x{scan_ms / bm25_ms:,.0f}")
+
+if __name__ == "__main__":
+    print("📊 search_database: linear scan vs BM25 index")
+    for size in (500, 2000, 8000):
+        run(size)
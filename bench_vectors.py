@@ -0,0 +1,60 @@
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from vector_index import VectorIndex, hashing_embedder
+
+# Measures the local vector index: embedding throughput of the default hashed
+# embedder, and batched top-k search over a memory-mapped matrix (random unit
+# vectors stand in for real embeddings so large corpora build quickly).
+# Usage: python bench_vectors.py
+
+random.seed(42)
+DIM = 256
+QUERIES = 64
+
+def random_embedder(texts):
+    rng = np.random.default_rng(abs(hash(texts[0])) % (2 ** 32))
+    out = rng.standard_normal((len(texts), DIM)).astype(np.float32)
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+def bench_embedder(n=2000):
+    words = [f"mot{i}" for i in range(5000)]
+    texts = [" ".join(random.choices(words, k=200)) for _ in range(n)]
+    t0 = time.perf_counter()
+    hashing_embedder(texts, DIM)
+    elapsed = time.perf_counter() - t0
+    print(f"hashing embedder | {n} chunks of 200 words | {n / elapsed:8.0f} chunks/s")
+
+def bench_search(rows, directory):
+    index = VectorIndex(directory, name=f"bench{rows}", embedder=random_embedder, dim=DIM, embedder_name="random")
+    index.clear()
+    batch = 5000
+    for start in range(0, rows, batch):
+        items = [(f"d{i}", f"text {i}") for i in range(start, min(rows, start + batch))]
+        index.add_many(items, f"g{start // batch}", {random.choice(["GLOBAL", "s1", "s2"])})
+    queries = [f"query {i}" for i in range(QUERIES)]
+
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search(q, {"s1", "GLOBAL"}, k=20)
+    single_ms = (time.perf_counter() - t0) / QUERIES * 1000
+
+    t0 = time.perf_counter()
+    index.search_many(queries, {"s1", "GLOBAL"}, k=20)
+    batched_ms = (time.perf_counter() - t0) / QUERIES * 1000
+
+    stats = index.stats()
+    print(f"{rows:>7} rows | {stats['bytes'] / 2 ** 20:6.1f} MiB | one query {single_ms:6.2f} ms | "
+          f"batched {batched_ms:6.2f} ms/query")
+
+if __name__ == "__main__":
+    print("📊 vector index: embedding and top-k search")
+    bench_embedder()
+    directory = tempfile.mkdtemp(prefix="bench_vectors_")
+    try:
+        for rows in (10000, 50000):
+            bench_search(rows, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
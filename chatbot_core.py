@@ -1,9 +1,17 @@
 import os
+import re
+import time
+import unicodedata
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime
 from pymongo import MongoClient
-from langchain_google_genai import ChatGoogleGenerativeAI
+from bson.objectid import ObjectId
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from dotenv import load_dotenv
+from workers import WorkerPool
+import llm_client
+import conversation_store
 
 # 1. SETUP
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -16,78 +24,403 @@ try:
 except Exception as e:
     print(f"❌ Chatbot DB Error: {e}")
 
-# 2. CHECK API KEY
-api_key = os.getenv("GOOGLE_API_KEY")
-
-if not api_key:
-    print("⚠️ CRITICAL ERROR: GOOGLE_API_KEY is missing!")
-    print("Please check your .env file.")
-    # Dummy key to prevent immediate crash, but calls will fail
-    api_key = "dummy_key"
-
-# Initialize Gemini AI
-llm = ChatGoogleGenerativeAI(
-    model="gemma-3-1b-it", # Using the Flash model as requested
-    temperature=0.7,
-    google_api_key=api_key,
-    convert_system_message_to_human=True # Helper for some Gemini versions
-)
+# 2. LLM
+# Model, temperature, timeout and backend (Gemini or the offline stub with
+# LLM_STUB_DELAY between streamed tokens) are configured in llm_client.
+def llm_unavailable():
+    return not llm_client.is_available()
 
 # ==============================================================================
 #                                HELPER: GET TEACHERS
 # ==============================================================================
 
-def get_staff_context():
+# The staff directory is cached in memory and kept in step with the admin
+# routes (see refresh_staff_member / remove_staff_member). The TTL forces a
+# full rebuild now and then in case the collection was edited elsewhere
+# (scripts, another worker process).
+STAFF_CACHE_TTL = int(os.getenv("STAFF_CACHE_TTL", "600"))
+
+# Only the STAFF_TOP_K best matching entries go into the prompt; questions that
+# match nobody get a compact summary instead of the whole directory.
+STAFF_TOP_K = int(os.getenv("STAFF_TOP_K", "5"))
+STAFF_SUMMARY_MAX_SUBJECTS = 40
+
+_STOPWORDS = {
+    "the", "and", "who", "what", "which", "does", "teach", "teaches", "teacher", "teachers",
+    "professor", "prof", "with", "for", "about", "les", "des", "qui", "que", "quoi", "est",
+    "une", "dans", "pour", "avec", "sur", "enseigne", "professeur", "cours", "module",
+}
+
+_staff_lock = threading.Lock()
+_staff_cache = {
+    "entries": {},      # staff _id (str) -> {"name", "subjects", "tokens"}
+    "index": {},        # token -> set of staff _id, over names and subjects
+    "text": None,       # rendered directory, rebuilt lazily after a change
+    "version": 0,
+    "built_at": 0.0,
+    "hits": 0,
+    "misses": 0,
+    "full_rebuilds": 0,
+    "incremental_updates": 0,
+}
+
+_prompt_stats = {
+    "queries": 0,
+    "matched": 0,
+    "fallbacks": 0,
+    "full_chars": 0,    # what the whole directory would have cost
+    "sent_chars": 0,    # what actually went into the prompt
+}
+
+def _tokenize(text):
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"[a-z0-9]+", text) if len(t) > 1 and t not in _STOPWORDS]
+
+def _format_staff_entry(staff):
+    """Reduces a staff document to the fields the directory needs."""
+    name = staff.get('full_name') or 'Unknown'
+    subjects, tokens = [], set(_tokenize(name))
+    for assignment in staff.get('teaching_assignments', []) or []:
+        sub_name = assignment.get('subject', '')
+        sub_type = assignment.get('type', '')
+        label = f"{sub_name} ({sub_type})"
+        if sub_name and label not in subjects:
+            subjects.append(label)
+            tokens.update(_tokenize(sub_name))
+    return {"name": name, "subjects": subjects, "tokens": tokens}
+
+def _render_staff_line(entry):
+    subjects_str = ", ".join(entry["subjects"]) if entry["subjects"] else "General Staff"
+    return f"- Name: {entry['name']} | Teaches: {subjects_str}\n"
+
+def _render_staff_directory(entries):
+    if not entries:
+        return "No staff information available."
+    text = "### UNIVERSITY STAFF DIRECTORY ###\n"
+    for entry in entries.values():
+        text += _render_staff_line(entry)
+    return text
+
+def _render_staff_summary(entries):
+    subjects = sorted({label.rsplit(" (", 1)[0] for e in entries.values() for label in e["subjects"]})
+    shown = ", ".join(subjects[:STAFF_SUMMARY_MAX_SUBJECTS])
+    if len(subjects) > STAFF_SUMMARY_MAX_SUBJECTS:
+        shown += f", ... (+{len(subjects) - STAFF_SUMMARY_MAX_SUBJECTS} more)"
+    return (
+        "### UNIVERSITY STAFF SUMMARY ###\n"
+        f"- {len(entries)} staff members on record.\n"
+        f"- Subjects taught: {shown or 'none listed'}\n"
+        "- Ask about a specific subject or teacher name for details.\n"
+    )
+
+def _put_staff_entry(staff_id, entry):
+    """Adds/replaces an entry and its postings. Caller must hold _staff_lock."""
+    _drop_staff_entry(staff_id)
+    _staff_cache["entries"][staff_id] = entry
+    for token in entry["tokens"]:
+        _staff_cache["index"].setdefault(token, set()).add(staff_id)
+
+def _drop_staff_entry(staff_id):
+    """Removes an entry and its postings. Caller must hold _staff_lock."""
+    old = _staff_cache["entries"].pop(staff_id, None)
+    if old is None:
+        return False
+    for token in old["tokens"]:
+        postings = _staff_cache["index"].get(token)
+        if postings is not None:
+            postings.discard(staff_id)
+            if not postings:
+                del _staff_cache["index"][token]
+    return True
+
+def _rebuild_staff_cache():
+    """Full scan of db.staff. Caller must hold _staff_lock."""
+    staff_members = db.staff.find({}, {"full_name": 1, "teaching_assignments": 1})
+    _staff_cache["entries"], _staff_cache["index"] = {}, {}
+    for staff in staff_members:
+        _put_staff_entry(str(staff['_id']), _format_staff_entry(staff))
+    _staff_cache["text"] = None
+    _staff_cache["built_at"] = time.time()
+    _staff_cache["version"] += 1
+    _staff_cache["full_rebuilds"] += 1
+
+def _staff_cache_expired():
+    return not _staff_cache["built_at"] or time.time() - _staff_cache["built_at"] > STAFF_CACHE_TTL
+
+def _ensure_staff_cache():
+    """Builds/renders the cache if needed. Caller must hold _staff_lock."""
+    if _staff_cache_expired():
+        _staff_cache["misses"] += 1
+        _rebuild_staff_cache()
+    elif _staff_cache["text"] is None:
+        _staff_cache["misses"] += 1
+    else:
+        _staff_cache["hits"] += 1
+        return
+    _staff_cache["text"] = _render_staff_directory(_staff_cache["entries"])
+
+def _match_staff(query, top_k):
+    """Ranks staff by how many query tokens hit their name/subjects. Caller must hold _staff_lock."""
+    scores = {}
+    for token in set(_tokenize(query)):
+        for staff_id in _staff_cache["index"].get(token, ()):
+            scores[staff_id] = scores.get(staff_id, 0) + 1
+    ranked = sorted(scores, key=lambda sid: (-scores[sid], _staff_cache["entries"][sid]["name"]))
+    return [_staff_cache["entries"][sid] for sid in ranked[:top_k]]
+
+def get_staff_context(query=None, top_k=None):
     """
-    Fetches all teachers/admins from MongoDB and formats them as a text string.
+    Returns the staff directory (teachers/admins and what they teach) as a text string.
+    Served from the in-memory cache; only the first call and TTL expiry hit MongoDB.
+
+    With a query, only the top_k staff whose name or subjects match it are returned,
+    or a compact summary when nobody matches.
     """
     try:
-        staff_members = list(db.staff.find({}, {"full_name": 1, "teaching_assignments": 1}))
-        
-        if not staff_members:
-            return "No staff information available."
-
-        text = "### UNIVERSITY STAFF DIRECTORY ###\n"
-        for staff in staff_members:
-            name = staff.get('full_name', 'Unknown')
-            
-            subjects = set()
-            assignments = staff.get('teaching_assignments', [])
-            
-            if assignments:
-                for assignment in assignments:
-                    sub_name = assignment.get('subject', '')
-                    sub_type = assignment.get('type', '')
-                    if sub_name:
-                        subjects.add(f"{sub_name} ({sub_type})")
-            
-            subjects_str = ", ".join(subjects) if subjects else "General Staff"
-            text += f"- Name: {name} | Teaches: {subjects_str}\n"
-        
-        return text
+        with _staff_lock:
+            _ensure_staff_cache()
+            full_text = _staff_cache["text"]
+            if query is None or not _staff_cache["entries"]:
+                return full_text
+
+            matches = _match_staff(query, top_k or STAFF_TOP_K)
+            if matches:
+                text = "### RELEVANT UNIVERSITY STAFF ###\n" + "".join(_render_staff_line(e) for e in matches)
+            else:
+                text = _render_staff_summary(_staff_cache["entries"])
+
+            _prompt_stats["queries"] += 1
+            _prompt_stats["matched" if matches else "fallbacks"] += 1
+            _prompt_stats["full_chars"] += len(full_text)
+            _prompt_stats["sent_chars"] += len(text)
+            return text
     except Exception as e:
         print(f"Error fetching staff context: {e}")
         return "Error retrieving staff information."
 
+def refresh_staff_member(staff_id=None, email=None):
+    """
+    Re-reads a single staff document and patches it into the cached directory.
+    Call after a staff member or their teaching_assignments change.
+    """
+    query = {"_id": ObjectId(staff_id)} if staff_id else {"email": email}
+    try:
+        staff = db.staff.find_one(query, {"full_name": 1, "teaching_assignments": 1})
+        with _staff_lock:
+            if not _staff_cache["built_at"]:
+                return  # Nothing cached yet, the next read builds everything.
+            if staff:
+                _put_staff_entry(str(staff['_id']), _format_staff_entry(staff))
+            elif staff_id:
+                _drop_staff_entry(str(staff_id))
+            _staff_cache["text"] = None
+            _staff_cache["version"] += 1
+            _staff_cache["incremental_updates"] += 1
+    except Exception as e:
+        print(f"⚠️ Staff cache refresh failed, forcing rebuild: {e}")
+        invalidate_staff_cache()
+
+def remove_staff_member(staff_id):
+    """Drops a deleted staff member from the cached directory."""
+    with _staff_lock:
+        if _drop_staff_entry(str(staff_id)):
+            _staff_cache["text"] = None
+            _staff_cache["version"] += 1
+            _staff_cache["incremental_updates"] += 1
+
+def invalidate_staff_cache():
+    """Forces a full rebuild on the next read (e.g. after bulk imports)."""
+    with _staff_lock:
+        _staff_cache["built_at"] = 0.0
+        _staff_cache["text"] = None
+
+def get_staff_cache_stats():
+    with _staff_lock:
+        lookups = _staff_cache["hits"] + _staff_cache["misses"]
+        return {
+            "version": _staff_cache["version"],
+            "entries": len(_staff_cache["entries"]),
+            "age_seconds": round(time.time() - _staff_cache["built_at"], 1) if _staff_cache["built_at"] else None,
+            "ttl_seconds": STAFF_CACHE_TTL,
+            "hits": _staff_cache["hits"],
+            "misses": _staff_cache["misses"],
+            "hit_rate": round(_staff_cache["hits"] / lookups, 3) if lookups else 0.0,
+            "full_rebuilds": _staff_cache["full_rebuilds"],
+            "incremental_updates": _staff_cache["incremental_updates"],
+            "indexed_tokens": len(_staff_cache["index"]),
+        }
+
+def get_staff_prompt_stats():
+    """Directory size that would have been sent vs. what was sent (~4 chars per token)."""
+    with _staff_lock:
+        q = _prompt_stats["queries"]
+        full, sent = _prompt_stats["full_chars"], _prompt_stats["sent_chars"]
+        return {
+            "queries": q,
+            "matched": _prompt_stats["matched"],
+            "fallbacks": _prompt_stats["fallbacks"],
+            "avg_chars_before": round(full / q) if q else 0,
+            "avg_chars_after": round(sent / q) if q else 0,
+            "est_tokens_saved": (full - sent) // 4,
+            "reduction": round(1 - sent / full, 3) if full else 0.0,
+        }
+
 # ==============================================================================
 #                                MAIN CHAT FUNCTION
 # ==============================================================================
 
-def get_ai_response(user_message, session_id, user_id=None):
-    if api_key == "dummy_key":
-        return "⚠️ Error: Google API Key is missing. Please check your .env file."
+# Compaction mode: older turns are folded into a rolling summary stored on the
+# conversation, so the prompt is summary + the recent turns instead of an
+# ever longer replay. CHAT_COMPACTION=0 falls back to the last 10 raw turns.
+CHAT_COMPACTION = os.getenv("CHAT_COMPACTION", "1") == "1"
+CHAT_RECENT_TURNS = int(os.getenv("CHAT_RECENT_TURNS", "6"))
+CHAT_SUMMARY_THRESHOLD = int(os.getenv("CHAT_SUMMARY_THRESHOLD", "8"))
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "3000"))
+CHAT_SUMMARY_MAX_TOKENS = 400
 
-    # 1. Fetch Chat History
+def _fit_history(summary, turns, budget):
+    """Drops the oldest turns, then trims the summary, until both fit in `budget` tokens."""
+    turn_costs = [llm_client.estimate_tokens(t['user']) + llm_client.estimate_tokens(t['ai']) for t in turns]
+    summary_cost = llm_client.estimate_tokens(summary)
+    while turns and summary_cost + sum(turn_costs) > budget:
+        turns, turn_costs = turns[1:], turn_costs[1:]
+    if summary and summary_cost + sum(turn_costs) > budget:
+        keep_chars = max(0, (budget - sum(turn_costs)) * 4)
+        summary = summary[-keep_chars:] if keep_chars else ""
+    return summary, turns
+
+def _fetch_history(session_id):
+    """Returns (summary, turns) as stored, before budgeting."""
+    if not CHAT_COMPACTION:
+        return "", conversation_store.get_recent_turns(session_id, 10)
+    # Hard cap: at most CHAT_RECENT_TURNS + CHAT_SUMMARY_THRESHOLD unsummarized turns
+    # (newest kept), so a lagging or failing compaction cannot grow the read; when it
+    # lags, older turns outside the window are left out. _fit_history then applies
+    # the token budget within this window.
+    history = conversation_store.get_compacted_history(session_id, CHAT_RECENT_TURNS + CHAT_SUMMARY_THRESHOLD)
+    return history["summary"], history["turns"]
+
+# Retrieval: passages from the files uploaded into the session (plus GLOBAL and
+# System documents) are added to the prompt. The search runs on a small thread
+# pool next to the history fetch, with a hard budget: if it has not answered
+# within CHAT_RETRIEVAL_BUDGET_MS the turn goes ahead without document context
+# (the search still finishes in the background, which also warms the index).
+CHAT_RETRIEVAL = os.getenv("CHAT_RETRIEVAL", "1") == "1"
+CHAT_RETRIEVAL_BUDGET_MS = int(os.getenv("CHAT_RETRIEVAL_BUDGET_MS", "50"))
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "1200"))
+RETRIEVAL_MAX_PENDING = 8   # searches still running (timed out ones included) before new ones are skipped
+
+_retrieval_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+_retrieval_lock = threading.Lock()
+_retrieval_stats = {"hit": 0, "empty": 0, "timeout": 0, "error": 0, "skipped": 0, "pending": 0, "total_ms": 0.0}
+
+def _search_documents(query, session_id):
+    # Local import keeps chatbot_core importable without pypdf/numpy; in the app,
+    # rag_utils is already loaded at startup (app.py imports it), so nothing is deferred.
+    from rag_utils import search_database
+    try:
+        return search_database(query, session_id)
+    finally:
+        with _retrieval_lock:
+            _retrieval_stats["pending"] -= 1
+
+def _start_retrieval(query, session_id):
+    if not (CHAT_RETRIEVAL and session_id):
+        return None
+    with _retrieval_lock:
+        if _retrieval_stats["pending"] >= RETRIEVAL_MAX_PENDING:
+            _retrieval_stats["skipped"] += 1
+            return None
+        _retrieval_stats["pending"] += 1
+    return _retrieval_pool.submit(_search_documents, query, session_id)
+
+def _cap_context(context, max_tokens):
+    """Keeps whole passages (best first) while they fit in max_tokens."""
+    kept, used = [], 0
+    for passage in context.split("\n\n") if context else []:
+        cost = llm_client.estimate_tokens(passage)
+        if used + cost > max_tokens:
+            if not kept:
+                kept.append(passage[:max_tokens * 4])
+            break
+        kept.append(passage)
+        used += cost
+    return "\n\n".join(kept)
+
+def _await_retrieval(future, started):
+    """(context, outcome): the passages found within the budget, capped, or "" on timeout/error."""
+    if future is None:
+        return "", "skipped" if CHAT_RETRIEVAL else "off"
+    remaining = CHAT_RETRIEVAL_BUDGET_MS / 1000 - (time.perf_counter() - started)
+    context = ""
+    try:
+        context = future.result(timeout=max(0.0, remaining))
+        outcome = "hit" if context else "empty"
+    except FutureTimeout:
+        outcome = "timeout"
+    except Exception as e:
+        print(f"❌ Retrieval Error: {e}")
+        outcome = "error"
+    with _retrieval_lock:
+        _retrieval_stats[outcome] += 1
+        _retrieval_stats["total_ms"] += (time.perf_counter() - started) * 1000
+    return _cap_context(context, CHAT_CONTEXT_MAX_TOKENS), outcome
+
+def get_retrieval_stats():
+    with _retrieval_lock:
+        waited = sum(_retrieval_stats[k] for k in ("hit", "empty", "timeout", "error"))
+        stats = {k: v for k, v in _retrieval_stats.items() if k != "total_ms"}
+        stats["avg_wait_ms"] = round(_retrieval_stats["total_ms"] / waited, 1) if waited else 0.0
+        stats["budget_ms"] = CHAT_RETRIEVAL_BUDGET_MS
+        return stats
+
+def _log_timings(session_id, timings):
+    parts = [f"{stage} {ms:.0f}ms" for stage, ms in timings.items() if isinstance(ms, (int, float))]
+    print(f"⏱️ Chat turn {session_id}: {' | '.join(parts)} (retrieval: {timings.get('retrieval_outcome', 'off')})")
+
+def build_chat_messages(user_message, session_id, timings=None):
+    """
+    Assembles system prompt + document excerpts + conversation summary + recent history
+    + the new message for the LLM. Per-stage durations (ms) are written into `timings`.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    retrieval = _start_retrieval(user_message, session_id)
+
+    # 1. Fetch Dynamic Context (Teachers relevant to the question)
+    t = time.perf_counter()
+    staff_info = get_staff_context(user_message)
+    timings["staff"] = (time.perf_counter() - t) * 1000
+
+    # 2. Fetch Chat History (runs while the document search is in flight)
+    t = time.perf_counter()
+    summary, turns = _fetch_history(session_id) if session_id else ("", [])
+    timings["history"] = (time.perf_counter() - t) * 1000
+
+    # 3. Document excerpts, within the retrieval budget
+    t = time.perf_counter()
+    context, timings["retrieval_outcome"] = _await_retrieval(retrieval, started)
+    timings["retrieval"] = (time.perf_counter() - started) * 1000 if retrieval else 0.0
+    timings["retrieval_wait"] = (time.perf_counter() - t) * 1000
+
+    # 4. Budget the history against what the prompt already costs
+    if CHAT_COMPACTION and session_id:
+        fixed_tokens = llm_client.estimate_tokens(staff_info) + llm_client.estimate_tokens(user_message) \
+            + llm_client.estimate_tokens(context) + 150
+        summary, turns = _fit_history(summary, turns, max(0, CHAT_PROMPT_TOKEN_BUDGET - fixed_tokens))
     history = []
-    if session_id:
-        convo = db.conversations.find_one({"session_id": session_id})
-        if convo:
-            for msg in convo.get('messages', [])[-10:]:
-                history.append(HumanMessage(content=msg['user']))
-                history.append(AIMessage(content=msg['ai']))
-
-    # 2. Fetch Dynamic Context (Teachers)
-    staff_info = get_staff_context()
+    for msg in turns:
+        history.append(HumanMessage(content=msg['user']))
+        history.append(AIMessage(content=msg['ai']))
+    summary_block = f"""
+    ### EARLIER IN THIS CONVERSATION (summary):
+    {summary}
+    """ if summary else ""
+    documents_block = f"""
+    ### COURSE DOCUMENTS (excerpts from files available in this conversation):
+    {context}
+    """ if context else ""
     
     # 3. Construct System Prompt
     # Gemini handles SystemMessages, but sometimes prefers them merged.
@@ -97,27 +430,142 @@ def get_ai_response(user_message, session_id, user_id=None):
     
     ### KNOWLEDGE BASE:
     {staff_info}
-    
+    {documents_block}
     ### INSTRUCTIONS:
     - Use the knowledge base above to answer questions about teachers and subjects.
     - If the user asks "Who teaches X?", look for the subject in the directory.
+    - When the course documents answer the question, use them and cite the SOURCE (file, page).
     - Be polite, concise, and helpful.
     - If you don't know the answer, strictly say "I don't have that information."
-    """
+    {summary_block}"""
 
-    messages = [SystemMessage(content=system_instruction)] + history + [HumanMessage(content=user_message)]
+    return [SystemMessage(content=system_instruction)] + history + [HumanMessage(content=user_message)]
 
-    # 4. Generate Response
+def get_ai_response(user_message, session_id, user_id=None):
+    if llm_unavailable():
+        return "⚠️ Error: Google API Key is missing. Please check your .env file."
+
+    timings = {}
+    messages = build_chat_messages(user_message, session_id, timings)
+
+    # 5. Generate Response
+    t = time.perf_counter()
     try:
-        response = llm.invoke(messages)
-        return response.content
+        return llm_client.invoke_chat("chat", messages)
+    except llm_client.LLMBusyError:
+        raise
     except Exception as e:
         return f"I'm having trouble connecting to Gemini right now. Error: {e}"
+    finally:
+        timings["llm"] = (time.perf_counter() - t) * 1000
+        _log_timings(session_id, timings)
+
+def stream_ai_response(user_message, session_id, user_id=None):
+    """Same as get_ai_response, but yields the answer chunk by chunk as the model produces it."""
+    if llm_unavailable():
+        yield "⚠️ Error: Google API Key is missing. Please check your .env file."
+        return
+
+    timings = {}
+    messages = build_chat_messages(user_message, session_id, timings)
+
+    t = time.perf_counter()
+    try:
+        for chunk in llm_client.stream_chat("chat", messages):
+            if "llm_first_token" not in timings:
+                timings["llm_first_token"] = (time.perf_counter() - t) * 1000
+            yield chunk
+    except llm_client.LLMBusyError:
+        raise
+    except Exception as e:
+        yield f"I'm having trouble connecting to Gemini right now. Error: {e}"
+    finally:
+        timings["llm"] = (time.perf_counter() - t) * 1000
+        _log_timings(session_id, timings)
 
 def generate_chat_title(first_message, ai_response):
-    if api_key == "dummy_key": return "New Chat"
+    if llm_unavailable(): return "New Chat"
     try:
         prompt = f"Summarize this conversation start into a short title (max 5 words):\nUser: {first_message}\nAI: {ai_response}"
-        return llm.invoke([HumanMessage(content=prompt)]).content.strip().replace('"', '')
+        return llm_client.invoke_chat("title", [HumanMessage(content=prompt)]).strip().replace('"', '')
     except:
-        return "New Chat"
\ No newline at end of file
+        return "New Chat"
+
+# ==============================================================================
+#                          BACKGROUND TITLE GENERATION
+# ==============================================================================
+
+# New conversations get PLACEHOLDER_TITLE right away; a background worker asks the
+# LLM for a real title and writes it back to the conversation document.
+PLACEHOLDER_TITLE = "New Chat"
+
+title_pool = WorkerPool("chat-titles",
+                        workers=int(os.getenv("TITLE_WORKERS", "2")),
+                        max_queue=int(os.getenv("TITLE_QUEUE_SIZE", "200")))
+
+def _write_chat_title(session_id, first_message, ai_response):
+    title = generate_chat_title(first_message, ai_response)
+    if title and title != PLACEHOLDER_TITLE:
+        # Only replace the placeholder, never a title set in the meantime.
+        conversation_store.set_title(session_id, title, only_if=PLACEHOLDER_TITLE)
+
+def schedule_chat_title(session_id, first_message, ai_response):
+    """Queues title generation for a new conversation. Returns False if the queue is full."""
+    return title_pool.submit(_write_chat_title, session_id, first_message, ai_response)
+
+def get_title_worker_stats():
+    return title_pool.stats()
+
+# ==============================================================================
+#                          ROLLING CONVERSATION SUMMARY
+# ==============================================================================
+
+compaction_pool = WorkerPool("chat-compaction",
+                             workers=int(os.getenv("COMPACTION_WORKERS", "1")),
+                             max_queue=int(os.getenv("COMPACTION_QUEUE_SIZE", "100")))
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+def _compact_conversation(session_id, latest_seq):
+    try:
+        previous_summary, previous_upto = conversation_store.get_summary(session_id)
+        fold_upto = latest_seq - CHAT_RECENT_TURNS
+        turns = conversation_store.get_turn_range(session_id, previous_upto, fold_upto)
+        if not turns:
+            return
+
+        transcript = "\n".join(f"User: {t['user']}\nAI: {t['ai']}" for t in turns)
+        prompt = f"""Update the running summary of a conversation between a student and the university assistant.
+Keep names, subjects, dates, decisions and open questions. Write at most {CHAT_SUMMARY_MAX_TOKENS // 2} words.
+
+CURRENT SUMMARY:
+{previous_summary or "(empty)"}
+
+NEW TURNS:
+{transcript}
+
+UPDATED SUMMARY:"""
+        summary = llm_client.invoke_chat("compaction", [HumanMessage(content=prompt)]).strip()
+        if summary:
+            conversation_store.save_summary(session_id, summary, turns[-1]['seq'], previous_upto)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(session_id)
+
+def maybe_schedule_compaction(session_id, latest_seq, summary_upto_seq):
+    """Queues a summary update once more than CHAT_SUMMARY_THRESHOLD turns sit outside the recent window."""
+    if not CHAT_COMPACTION or latest_seq - CHAT_RECENT_TURNS - summary_upto_seq < CHAT_SUMMARY_THRESHOLD:
+        return False
+    with _compacting_lock:
+        if session_id in _compacting:
+            return False
+        _compacting.add(session_id)
+    if not compaction_pool.submit(_compact_conversation, session_id, latest_seq):
+        with _compacting_lock:
+            _compacting.discard(session_id)
+        return False
+    return True
+
+def get_compaction_stats():
+    return compaction_pool.stats()
+
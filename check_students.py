@@ -23,6 +23,9 @@ db.marks.delete_many({})
 db.presence.delete_many({})
 db.document_requests.delete_many({})
 db.quizzes.delete_many({})
+db.quiz_attempts.delete_many({})
+db.quiz_stats.delete_many({})
+db.quiz_class_stats.delete_many({})
 print("✅ Database cleaned.")
 
 # 3. DEFINE SUBJECTS FOR YOUR 4 MAJORS
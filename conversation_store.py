@@ -0,0 +1,159 @@
+import os
+import time
+from pymongo import MongoClient, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+# ==============================================================================
+#                          PAGED CONVERSATION STORAGE
+# ==============================================================================
+# db.conversations holds one small metadata document per chat session
+# (title, user_id, timestamps, message_count). Each user/AI exchange is its own
+# document in db.messages, numbered by seq (1, 2, ...) and indexed on
+# (session_id, seq), so reading history only touches the turns it needs.
+#
+# Sessions created before this layout kept every turn in an embedded
+# `messages` array; they are moved over the first time they are touched
+# (or all at once with migrate_conversations.py).
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+try:
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client["chatbot_ai_app"]
+except Exception as e:
+    print(f"❌ Conversation Store DB Error: {e}")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+_indexes_ready = False
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    db.messages.create_index([("session_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+    db.conversations.create_index("session_id")
+    db.conversations.create_index([("user_id", ASCENDING), ("updated_at", DESCENDING)])
+    _indexes_ready = True
+
+def _migrate_legacy(session_id, legacy_messages):
+    """Moves an embedded messages array into db.messages (seq 1..n). Idempotent."""
+    docs = [{"session_id": session_id, "seq": i + 1, "user": m.get('user'), "ai": m.get('ai'),
+             "time": m.get('time')} for i, m in enumerate(legacy_messages)]
+    if docs:
+        try:
+            db.messages.insert_many(docs, ordered=False)
+        except BulkWriteError:
+            pass  # another request already moved (some of) them
+    db.conversations.update_one({"session_id": session_id, "messages": {"$exists": True}},
+                                {"$unset": {"messages": ""}, "$inc": {"message_count": len(docs)}})
+    print(f"🔄 Migrated {len(docs)} messages of session {session_id}")
+
+def append_turn(session_id, user_id, user_msg, ai_msg, placeholder_title):
+    """
+    Stores one exchange and bumps the conversation counters in a single round trip.
+    Returns {"seq", "title", "is_new", "summary_upto_seq"}.
+    """
+    ensure_indexes()
+    now = time.time()
+    convo = db.conversations.find_one_and_update(
+        {"session_id": session_id},
+        {"$inc": {"message_count": 1},
+         "$set": {"updated_at": now, "user_id": user_id},
+         "$setOnInsert": {"created_at": now, "title": placeholder_title}},
+        projection={"title": 1, "message_count": 1, "messages": 1, "summary_upto_seq": 1},
+        upsert=True, return_document=ReturnDocument.AFTER)
+
+    legacy = convo.get('messages')
+    seq = convo['message_count']
+    if legacy:
+        _migrate_legacy(session_id, legacy)
+        seq += len(legacy)
+
+    db.messages.insert_one({"session_id": session_id, "seq": seq, "user": user_msg, "ai": ai_msg, "time": now})
+    return {"seq": seq, "title": convo.get('title'), "is_new": seq == 1,
+            "summary_upto_seq": convo.get('summary_upto_seq', 0)}
+
+def get_recent_turns(session_id, limit=10):
+    """The last `limit` exchanges, oldest first, fetched by index from the tail."""
+    cursor = db.messages.find({"session_id": session_id}, {"_id": 0, "seq": 1, "user": 1, "ai": 1}) \
+                        .sort("seq", DESCENDING).limit(limit)
+    turns = list(cursor)
+    if not turns:
+        convo = db.conversations.find_one({"session_id": session_id, "messages": {"$exists": True}},
+                                          {"messages": {"$slice": -limit}})
+        if convo:
+            return convo.get('messages', [])
+    return turns[::-1]
+
+def get_compacted_history(session_id, max_turns):
+    """
+    Rolling summary of the older turns plus the turns it does not cover yet
+    (at most max_turns, newest kept). Returns {"summary", "summary_upto_seq", "turns"}.
+    """
+    convo = db.conversations.find_one({"session_id": session_id},
+                                      {"summary": 1, "summary_upto_seq": 1, "messages": {"$slice": -max_turns}}) or {}
+    upto = convo.get('summary_upto_seq', 0)
+    if convo.get('messages'):
+        turns = convo['messages']   # legacy layout, never summarized
+    else:
+        turns = list(db.messages.find({"session_id": session_id, "seq": {"$gt": upto}},
+                                      {"_id": 0, "seq": 1, "user": 1, "ai": 1})
+                                .sort("seq", DESCENDING).limit(max_turns))[::-1]
+    return {"summary": convo.get('summary', ''), "summary_upto_seq": upto, "turns": turns}
+
+def get_summary(session_id):
+    """(rolling summary, seq of the last turn it covers)."""
+    convo = db.conversations.find_one({"session_id": session_id}, {"summary": 1, "summary_upto_seq": 1}) or {}
+    return convo.get('summary', ''), convo.get('summary_upto_seq', 0)
+
+def get_turn_range(session_id, after_seq, upto_seq):
+    """Turns with after_seq < seq <= upto_seq, oldest first."""
+    return list(db.messages.find({"session_id": session_id, "seq": {"$gt": after_seq, "$lte": upto_seq}},
+                                 {"_id": 0, "seq": 1, "user": 1, "ai": 1}).sort("seq", ASCENDING))
+
+def save_summary(session_id, summary, upto_seq, previous_upto):
+    """Stores a new rolling summary unless another worker already moved it forward."""
+    res = db.conversations.update_one(
+        {"session_id": session_id, "$or": [{"summary_upto_seq": previous_upto},
+                                           {"summary_upto_seq": {"$exists": False}}]},
+        {"$set": {"summary": summary, "summary_upto_seq": upto_seq, "summary_updated_at": time.time()}})
+    return res.modified_count == 1
+
+def get_page(session_id, user_id, before=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of a conversation, oldest first: the `limit` messages with seq < before
+    (or the latest ones). next_cursor is passed back as `before` for the previous page.
+    Returns None if the session does not belong to the user.
+    """
+    ensure_indexes()
+    convo = db.conversations.find_one({"session_id": session_id, "user_id": user_id},
+                                      {"title": 1, "message_count": 1, "messages": 1})
+    if not convo:
+        return None
+    if convo.get('messages'):
+        _migrate_legacy(session_id, convo['messages'])
+
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    query = {"session_id": session_id}
+    if before is not None:
+        query["seq"] = {"$lt": int(before)}
+    page = list(db.messages.find(query, {"_id": 0, "session_id": 0}).sort("seq", DESCENDING).limit(limit))[::-1]
+
+    oldest = page[0]['seq'] if page else None
+    has_more = bool(oldest and oldest > 1)
+    return {"messages": page, "title": convo.get('title'),
+            "next_cursor": oldest if has_more else None, "has_more": has_more}
+
+def set_title(session_id, title, only_if=None):
+    query = {"session_id": session_id}
+    if only_if is not None:
+        query["title"] = only_if
+    db.conversations.update_one(query, {"$set": {"title": title}})
+
+def list_conversations(user_id):
+    return list(db.conversations.find({"user_id": user_id}, {"_id": 0, "session_id": 1, "title": 1})
+                                .sort("updated_at", DESCENDING))
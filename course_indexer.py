@@ -0,0 +1,215 @@
+import os
+import re
+import sys
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pymongo import MongoClient
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from workers import WorkerPool
+import rag_utils
+
+# ==============================================================================
+#                          COURSE MATERIAL INDEXER
+# ==============================================================================
+# Makes the files teachers upload (static/courses, db.course_materials)
+# searchable from every chat: their text is stored as a materials entry with
+# session_id "GLOBAL", which search_database always includes.
+#
+# PDF pages are read with pypdf; PPTX slides straight from the slide XML inside
+# the zip (no python-pptx needed). A file is skipped when its mtime is the one
+# recorded at the last indexing, or when the mtime moved but the SHA-256 did
+# not. Extraction of several files runs in a process pool.
+#
+# Run from the command line while the app is up, the indexer only writes
+# MongoDB and the shared vector files (which take a file lock for every
+# change). The BM25 snapshot belongs to the app: it picks the new materials
+# up from db.materials on its next sync and saves the snapshot itself.
+#
+# Usage: python course_indexer.py [--force]
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+try:
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client["chatbot_ai_app"]
+except Exception as e:
+    print(f"❌ Course Indexer DB Error: {e}")
+
+COURSE_INDEX_WORKERS = int(os.getenv("COURSE_INDEX_WORKERS", str(min(4, os.cpu_count() or 1))))
+SUPPORTED_TYPES = ("pdf", "pptx")
+
+course_index_pool = WorkerPool("course-indexer", workers=1, max_queue=20)
+
+_NS = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+
+# ==============================================================================
+#                                 EXTRACTION
+# ==============================================================================
+
+def _slide_names(z):
+    """Slide XML files in presentation order (falls back to slideN numbering)."""
+    names = set(z.namelist())
+    try:
+        rels = ET.fromstring(z.read("ppt/_rels/presentation.xml.rels"))
+        targets = {r.get("Id"): "ppt/" + r.get("Target").lstrip("/").replace("ppt/", "", 1)
+                   for r in rels.findall("rel:Relationship", _NS)}
+        pres = ET.fromstring(z.read("ppt/presentation.xml"))
+        ordered = [targets.get(s.get(f"{{{_NS['r']}}}id")) for s in pres.iterfind("p:sldIdLst/p:sldId", _NS)]
+        ordered = [n for n in ordered if n in names]
+        if ordered:
+            return ordered
+    except (KeyError, ET.ParseError):
+        pass
+    numbered = [(int(m.group(1)), n) for n in names if (m := re.fullmatch(r"ppt/slides/slide(\d+)\.xml", n))]
+    return [n for _, n in sorted(numbered)]
+
+def extract_pptx_pages(path):
+    """[(slide_number, text), ...] for the non-empty slides of a .pptx, one line per paragraph."""
+    pages = []
+    with zipfile.ZipFile(path) as z:
+        for number, name in enumerate(_slide_names(z), start=1):
+            root = ET.fromstring(z.read(name))
+            lines = ["".join(t.text or "" for t in p.iterfind(".//a:t", _NS)) for p in root.iterfind(".//a:p", _NS)]
+            text = "\n".join(line for line in lines if line.strip())
+            if text:
+                pages.append((number, text))
+    return pages
+
+def _extract_file(path, file_type):
+    """Process-pool task: (pages, parse_ms) of one course file."""
+    t0 = time.perf_counter()
+    if file_type == "pptx":
+        pages = extract_pptx_pages(path)
+    else:
+        pages = list(rag_utils.iter_pdf_pages(path))
+    return pages, (time.perf_counter() - t0) * 1000
+
+# ==============================================================================
+#                                  INDEXING
+# ==============================================================================
+
+def _plan(cm, force, report):
+    """(path, file_type, content_hash, size) if the file needs (re)indexing, else None."""
+    file_type = (cm.get('file_type') or cm.get('filename', '').rsplit('.', 1)[-1]).lower()
+    if file_type not in SUPPORTED_TYPES:
+        report["unsupported"] += 1
+        return None
+    path = os.path.join(base_dir, (cm.get('file_path') or '').lstrip('/'))
+    if not os.path.exists(path):
+        report["missing"] += 1
+        return None
+    mtime = os.path.getmtime(path)
+    if not force and cm.get('material_id') and cm.get('indexed_mtime') == mtime:
+        report["unchanged"] += 1
+        return None
+    content_hash, size = rag_utils.hash_upload(path)
+    if not force and cm.get('material_id') and cm.get('indexed_hash') == content_hash:
+        db.course_materials.update_one({"_id": cm['_id']}, {"$set": {"indexed_mtime": mtime}})
+        report["unchanged"] += 1
+        return None
+    return path, file_type, content_hash, size, mtime
+
+def _store(cms, content_hash, pages, report):
+    """Replaces the materials entry of each course material sharing this file."""
+    for cm, mtime in cms:
+        if cm.get('material_id'):
+            rag_utils.remove_material(ObjectId(cm['material_id']))
+        update = {"indexed_hash": content_hash, "indexed_mtime": mtime, "indexed_at": time.time()}
+        if pages:
+            material = rag_utils.add_material({
+                "session_id": "GLOBAL", "title": cm.get('filename'), "type": "Course Material",
+                "uploaded_by": cm.get('uploaded_by'), "course_material_id": str(cm['_id']),
+                "subject": cm.get('subject'), "major": cm.get('major'),
+            }, content_hash, pages, persist=False)
+            update.update(material_id=str(material['_id']), index_status="indexed", num_chunks=material['num_chunks'])
+            report["indexed"] += 1
+        else:
+            update.update(material_id=None, index_status="empty")
+            report["empty"] += 1
+        db.course_materials.update_one({"_id": cm['_id']}, {"$set": update})
+
+def index_course_materials(ids=None, force=False, workers=None, persist=True):
+    """
+    Indexes new or changed course materials (all of them, or the given _ids).
+    persist=False leaves the BM25 snapshot to the app process (CLI runs).
+    Returns a report: counts per outcome, pages, bytes parsed and throughput.
+    """
+    workers = workers or COURSE_INDEX_WORKERS
+    started = time.perf_counter()
+    report = {"files": 0, "indexed": 0, "unchanged": 0, "unsupported": 0, "missing": 0, "empty": 0,
+              "failed": 0, "cached": 0, "pages": 0, "bytes": 0}
+    query = {"_id": {"$in": [ObjectId(i) for i in ids]}} if ids else {}
+
+    todo = {}   # content_hash -> {"path", "type", "size", "cms": [(cm, mtime), ...]}
+    for cm in db.course_materials.find(query):
+        report["files"] += 1
+        planned = _plan(cm, force, report)
+        if planned:
+            path, file_type, content_hash, size, mtime = planned
+            todo.setdefault(content_hash, {"path": path, "type": file_type, "size": size, "cms": []})["cms"].append((cm, mtime))
+
+    def finish(content_hash, pages, parse_ms=None):
+        job = todo[content_hash]
+        if parse_ms is not None:
+            rag_utils.cache_pages(content_hash, pages, job["size"], parse_ms)
+            report["bytes"] += job["size"]
+        report["pages"] += len(pages)
+        _store(job["cms"], content_hash, pages, report)
+
+    to_parse = []
+    for content_hash in todo:
+        pages = rag_utils.get_cached_pages(content_hash)
+        if pages is not None:
+            report["cached"] += 1
+            finish(content_hash, pages)
+        else:
+            to_parse.append(content_hash)
+
+    if workers > 1 and len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_extract_file, todo[h]["path"], todo[h]["type"]): h for h in to_parse}
+            for future in as_completed(futures):
+                content_hash = futures[future]
+                try:
+                    finish(content_hash, *future.result())
+                except Exception as e:
+                    print(f"❌ Course Index Error ({todo[content_hash]['path']}): {e}")
+                    report["failed"] += len(todo[content_hash]["cms"])
+    else:
+        for content_hash in to_parse:
+            try:
+                finish(content_hash, *_extract_file(todo[content_hash]["path"], todo[content_hash]["type"]))
+            except Exception as e:
+                print(f"❌ Course Index Error ({todo[content_hash]['path']}): {e}")
+                report["failed"] += len(todo[content_hash]["cms"])
+
+    if todo and persist:
+        rag_utils.save_search_index()
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 2)
+    report["files_per_s"] = round(report["files"] / elapsed, 1) if elapsed else 0.0
+    report["pages_per_s"] = round(report["pages"] / elapsed, 1) if elapsed else 0.0
+    report["mb_per_s"] = round(report["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed else 0.0
+    return report
+
+def schedule_course_indexing(ids):
+    """Indexes freshly uploaded course materials in the background."""
+    return course_index_pool.submit(index_course_materials, [str(i) for i in ids])
+
+if __name__ == "__main__":
+    force = "--force" in sys.argv[1:]
+    print(f"📚 Indexing course materials ({COURSE_INDEX_WORKERS} processes{', forced' if force else ''})...")
+    r = index_course_materials(force=force, persist=False)
+    print(f"✅ {r['files']} files: {r['indexed']} indexed, {r['unchanged']} unchanged, {r['cached']} from text cache, "
+          f"{r['unsupported']} unsupported, {r['missing']} missing, {r['empty']} without text, {r['failed']} failed")
+    print(f"⏱️ {r['seconds']} s | {r['files_per_s']} files/s | {r['pages_per_s']} pages/s | "
+          f"{r['bytes'] / (1024 * 1024):.1f} MB parsed at {r['mb_per_s']} MB/s")
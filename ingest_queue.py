@@ -0,0 +1,140 @@
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from pymongo import MongoClient, ReturnDocument
+from dotenv import load_dotenv
+from workers import WorkerPool
+
+# ==============================================================================
+#                         ASYNCHRONOUS DOCUMENT INGESTION
+# ==============================================================================
+# /api/upload only spools the file to disk and records a job in db.ingest_jobs
+# (queued -> processing -> done | failed); a small worker pool then parses,
+# chunks and indexes it with rag_utils.index_document. The client polls
+# /api/upload/status/<job_id>. A document becomes searchable when its
+# materials entry is written, which index_document does last, so the chat
+# never sees a half-ingested file.
+#
+# Jobs survive a restart: resume_pending_jobs() re-queues spooled jobs that
+# were still queued, or stuck in processing longer than INGEST_STALE_S.
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+try:
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client["chatbot_ai_app"]
+except Exception as e:
+    print(f"❌ Ingest Queue DB Error: {e}")
+
+INGEST_DIR = os.path.join(base_dir, "index_data", "ingest")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "50"))
+INGEST_STALE_S = int(os.getenv("INGEST_STALE_S", "600"))
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL", str(7 * 24 * 3600)))   # finished jobs are kept a week
+
+ingest_pool = WorkerPool("ingest", workers=INGEST_WORKERS, max_queue=INGEST_MAX_QUEUE)
+
+_indexes_ready = False
+
+class IngestBusyError(Exception):
+    """The ingestion queue is full; the upload was not accepted."""
+    retry_after = 10
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    db.ingest_jobs.create_index("job_id", unique=True)
+    db.ingest_jobs.create_index("status")
+    db.ingest_jobs.create_index("finished_at", expireAfterSeconds=INGEST_JOB_TTL)
+    _indexes_ready = True
+
+def _spool_path(job_id):
+    return os.path.join(INGEST_DIR, f"{job_id}.pdf")
+
+def _update(job_id, **fields):
+    fields["updated_at"] = time.time()
+    db.ingest_jobs.update_one({"job_id": job_id}, {"$set": fields})
+
+def _process(job_id):
+    """Worker: claims the job, runs the ingestion, records the outcome."""
+    job = db.ingest_jobs.find_one_and_update(
+        {"job_id": job_id, "status": "queued"},
+        {"$set": {"status": "processing", "stage": "starting", "progress": 5,
+                  "started_at": time.time(), "updated_at": time.time()}},
+        return_document=ReturnDocument.AFTER)
+    if not job:
+        return   # already taken by another worker/process
+    from rag_utils import index_document
+
+    def progress(stage, pct):
+        _update(job_id, stage=stage, progress=pct)
+
+    path = _spool_path(job_id)
+    ok = False
+    try:
+        ok = index_document(path, job['filename'], job['session_id'], progress=progress)
+    except Exception as e:
+        print(f"❌ Ingest Error ({job_id}): {e}")
+    _update(job_id, status="done" if ok else "failed", stage="done" if ok else "failed",
+            progress=100 if ok else job.get('progress', 0),
+            error=None if ok else "Le fichier n'a pas pu être lu.",
+            finished_at=datetime.now(timezone.utc))
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def enqueue_upload(file_storage, filename, session_id, user_id):
+    """Spools the upload and queues it. Returns the job id; raises IngestBusyError when full."""
+    ensure_indexes()
+    job_id = uuid.uuid4().hex
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    file_storage.save(_spool_path(job_id))
+    now = time.time()
+    db.ingest_jobs.insert_one({
+        "job_id": job_id, "session_id": session_id, "user_id": user_id, "filename": filename,
+        "size": os.path.getsize(_spool_path(job_id)), "status": "queued", "stage": "queued",
+        "progress": 0, "created_at": now, "updated_at": now,
+    })
+    if not ingest_pool.submit(_process, job_id):
+        os.remove(_spool_path(job_id))
+        _update(job_id, status="failed", stage="rejected", error="File d'attente pleine.",
+                finished_at=datetime.now(timezone.utc))
+        raise IngestBusyError()
+    return job_id
+
+def get_job(job_id, user_id):
+    """Public view of a job, or None if it does not exist / belongs to someone else."""
+    job = db.ingest_jobs.find_one({"job_id": job_id, "user_id": user_id},
+                                  {"_id": 0, "user_id": 0, "finished_at": 0})
+    if job and job['status'] == "queued":
+        job['queue_depth'] = ingest_pool.stats()['queue_depth']
+    return job
+
+def resume_pending_jobs():
+    """Re-queues spooled jobs left behind by a restart. Returns how many were resumed."""
+    ensure_indexes()
+    stale = time.time() - INGEST_STALE_S
+    resumed = 0
+    for job in db.ingest_jobs.find({"$or": [{"status": "queued"},
+                                            {"status": "processing", "updated_at": {"$lt": stale}}]},
+                                   {"job_id": 1, "status": 1}):
+        if not os.path.exists(_spool_path(job['job_id'])):
+            _update(job['job_id'], status="failed", stage="lost", error="Fichier temporaire introuvable.",
+                    finished_at=datetime.now(timezone.utc))
+            continue
+        db.ingest_jobs.update_one({"job_id": job['job_id'], "status": job['status']},
+                                  {"$set": {"status": "queued", "stage": "queued"}})
+        if ingest_pool.submit(_process, job['job_id']):
+            resumed += 1
+    if resumed:
+        print(f"🔄 Resumed {resumed} ingestion jobs")
+    return resumed
+
+def get_ingest_stats():
+    counts = {row['_id']: row['n'] for row in db.ingest_jobs.aggregate(
+        [{"$group": {"_id": "$status", "n": {"$sum": 1}}}])}
+    return {"jobs": counts, "workers": ingest_pool.stats()}
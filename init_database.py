@@ -14,6 +14,8 @@ def init_db():
     print("🗑️  Clearing old data...")
     db.users.drop()
     db.materials.drop()
+    db.material_chunks.drop()
+    db.document_texts.drop()
     db.chat_logs.drop()
 
     print("👥 Creating Users...")
@@ -0,0 +1,433 @@
+import os
+import re
+import time
+import heapq
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+# ==============================================================================
+#                    SHARED LLM CLIENT (chat, quiz, summary, planner)
+# ==============================================================================
+# Every AI feature goes through this module instead of configuring its own
+# Gemini client at import time. Nothing heavy is imported or constructed until
+# the first call, models are built once per (model, temperature, timeout) and
+# reused, and genai is configured a single time so all features share its
+# underlying HTTP client.
+#
+# Environment:
+#   LLM_BACKEND              gemini (default) | stub
+#   LLM_MODEL                default model for every feature
+#   LLM_TIMEOUT              default request timeout in seconds
+#   LLM_MODEL_<FEATURE>      per-feature override, e.g. LLM_MODEL_QUIZ
+#   LLM_TEMPERATURE_<FEATURE>
+#   LLM_TIMEOUT_<FEATURE>
+#   LLM_STUB_DELAY           seconds between streamed tokens of the stub backend
+#   LLM_MAX_IN_FLIGHT        concurrent upstream calls allowed (all features)
+#   LLM_MAX_QUEUE            callers allowed to wait for a slot before 429s
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+api_key = os.getenv("GOOGLE_API_KEY")
+
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gemma-3-1b-it")
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# temperature None = model default (what quiz/summary/planner always used).
+# priority: lower is served first when calls queue up for a slot.
+# max_wait: seconds a call may wait for a slot before it is rejected.
+FEATURE_SETTINGS = {
+    "chat":    {"temperature": 0.7,  "priority": 0, "max_wait": 10},
+    "quiz":    {"temperature": None, "priority": 1, "max_wait": 15},
+    "quiz_pool": {"temperature": None, "priority": 3, "max_wait": 60},
+    "planner": {"temperature": None, "priority": 2, "max_wait": 20},
+    "summary": {"temperature": None, "priority": 2, "max_wait": 20},
+    "summary_map": {"temperature": 0.2, "priority": 2, "max_wait": 30},
+    "title":   {"temperature": 0.7,  "priority": 3, "max_wait": 60},
+    "compaction": {"temperature": 0.2, "priority": 3, "max_wait": 60},
+}
+
+def get_settings(feature):
+    """Resolved model/temperature/timeout for a feature (env overrides win)."""
+    base = FEATURE_SETTINGS.get(feature, {})
+    key = feature.upper()
+    temperature = os.getenv(f"LLM_TEMPERATURE_{key}")
+    return {
+        "feature": feature,
+        "model": os.getenv(f"LLM_MODEL_{key}", base.get("model", DEFAULT_MODEL)),
+        "temperature": float(temperature) if temperature else base.get("temperature"),
+        "timeout": float(os.getenv(f"LLM_TIMEOUT_{key}", base.get("timeout", DEFAULT_TIMEOUT))),
+        "priority": base.get("priority", 2),
+        "max_wait": base.get("max_wait", 20),
+    }
+
+def estimate_tokens(text):
+    """
+    Local token estimate, no API call: words and punctuation marks count as
+    ~1.3 tokens each (sub-word splits), never less than 1 token per 4 chars.
+    """
+    text = str(text or "")
+    pieces = len(re.findall(r"\w+|[^\w\s]", text))
+    return max(int(pieces * 1.3), len(text) // 4)
+
+def _messages_to_text(messages):
+    """Flattens LangChain messages for backends that only take a prompt string."""
+    return "\n\n".join(str(getattr(m, "content", m)) for m in messages)
+
+# ==============================================================================
+#                                BACKENDS
+# ==============================================================================
+
+class GeminiBackend:
+    """Google Gemini through google-generativeai (prompts) and LangChain (chat)."""
+    name = "gemini"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._configured = False
+        self._models = {}
+
+    def available(self):
+        return bool(api_key)
+
+    def _cached(self, kind, settings, build):
+        key = (kind, settings["model"], settings["temperature"], settings["timeout"])
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._models[key] = build()
+        return model
+
+    def _generative_model(self, settings):
+        def build():
+            import google.generativeai as genai
+            if not self._configured:
+                genai.configure(api_key=api_key)
+                self._configured = True
+            config = {"temperature": settings["temperature"]} if settings["temperature"] is not None else None
+            return genai.GenerativeModel(settings["model"], generation_config=config)
+        return self._cached("prompt", settings, build)
+
+    def _chat_model(self, settings):
+        def build():
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            return ChatGoogleGenerativeAI(
+                model=settings["model"],
+                temperature=settings["temperature"] if settings["temperature"] is not None else 0.7,
+                google_api_key=api_key,
+                timeout=settings["timeout"],
+                convert_system_message_to_human=True # Helper for some Gemini versions
+            )
+        return self._cached("chat", settings, build)
+
+    def generate(self, settings, prompt):
+        model = self._generative_model(settings)
+        return model.generate_content(prompt, request_options={"timeout": settings["timeout"]}).text
+
+    def generate_stream(self, settings, prompt):
+        model = self._generative_model(settings)
+        for chunk in model.generate_content(prompt, stream=True, request_options={"timeout": settings["timeout"]}):
+            if chunk.text:
+                yield chunk.text
+
+    def invoke_chat(self, settings, messages):
+        return self._chat_model(settings).invoke(messages).content
+
+    def stream_chat(self, settings, messages):
+        for chunk in self._chat_model(settings).stream(messages):
+            if chunk.content:
+                yield chunk.content
+
+    def models_built(self):
+        return len(self._models)
+
+
+class StubBackend:
+    """
+    Deterministic offline backend: the same prompt always gives the same text.
+    Features can register a responder (set_stub_responder) to return output in
+    the shape they parse, e.g. quiz JSON. Streams word by word with LLM_STUB_DELAY.
+    """
+    name = "stub"
+
+    def __init__(self):
+        self.responders = {}
+        self.delay = float(os.getenv("LLM_STUB_DELAY", "0"))
+
+    def available(self):
+        return True
+
+    def _text(self, feature, prompt):
+        responder = self.responders.get(feature)
+        if responder:
+            return responder(prompt)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        words = re.findall(r"\w+", prompt)[-12:]
+        return f"[{feature} stub {digest}] " + " ".join(words)
+
+    def generate(self, settings, prompt):
+        return self._text(settings["feature"], prompt)
+
+    def generate_stream(self, settings, prompt):
+        for token in re.findall(r"\S+\s*", self._text(settings["feature"], prompt)):
+            if self.delay:
+                time.sleep(self.delay)
+            yield token
+
+    def invoke_chat(self, settings, messages):
+        return self._text(settings["feature"], _messages_to_text(messages))
+
+    def stream_chat(self, settings, messages):
+        yield from self.generate_stream(settings, _messages_to_text(messages))
+
+    def models_built(self):
+        return 0
+
+
+_backends = {"gemini": GeminiBackend(), "stub": StubBackend()}
+_backend_name = os.getenv("LLM_BACKEND", "gemini").lower()
+
+def register_backend(name, backend):
+    """Plugs in another backend (same methods as GeminiBackend)."""
+    _backends[name] = backend
+
+def set_backend(name):
+    global _backend_name
+    if name not in _backends:
+        raise ValueError(f"Unknown LLM backend: {name}")
+    _backend_name = name
+
+def get_backend():
+    return _backends[_backend_name]
+
+def set_stub_responder(feature, responder):
+    """responder(prompt) -> text, used by the stub backend for that feature."""
+    _backends["stub"].responders[feature] = responder
+
+def is_available():
+    return get_backend().available()
+
+# ==============================================================================
+#                           ADMISSION CONTROL
+# ==============================================================================
+
+class LLMBusyError(Exception):
+    """
+    The call was not admitted: the wait queue is full (status 429) or no slot
+    freed up within the feature's max_wait (status 503). Routes turn this into
+    an HTTP error with Retry-After instead of fallback text.
+    """
+    def __init__(self, feature, status, message, retry_after=5):
+        super().__init__(message)
+        self.feature = feature
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Global limit on concurrent upstream LLM calls. Callers over the limit wait
+    in a priority queue (interactive chat before batch summaries, FIFO within
+    a priority) for at most their max_wait; when too many are already waiting
+    new callers are rejected straight away.
+    """
+
+    def __init__(self, max_in_flight, max_queue):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = []   # heap of (priority, seq)
+        self._seq = 0
+        self._stats = {"admitted": 0, "rejected_full": 0, "rejected_timeout": 0, "peak_queue": 0}
+        self._wait = {}      # feature -> {"count", "total_s", "max_s"}
+
+    def _record_wait(self, feature, waited):
+        w = self._wait.setdefault(feature, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+        w["count"] += 1
+        w["total_s"] += waited
+        w["max_s"] = max(w["max_s"], waited)
+
+    def acquire(self, feature, priority, max_wait):
+        started = time.time()
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiting:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+                self._record_wait(feature, 0.0)
+                return
+            if len(self._waiting) >= self.max_queue:
+                self._stats["rejected_full"] += 1
+                raise LLMBusyError(feature, 429, "Too many AI requests queued.")
+
+            self._seq += 1
+            ticket = (priority, self._seq)
+            heapq.heappush(self._waiting, ticket)
+            self._stats["peak_queue"] = max(self._stats["peak_queue"], len(self._waiting))
+            deadline = started + max_wait
+            while not (self._waiting[0] == ticket and self._in_flight < self.max_in_flight):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._stats["rejected_timeout"] += 1
+                    self._cond.notify_all()
+                    raise LLMBusyError(feature, 503, "AI service busy, timed out waiting for a slot.")
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._record_wait(feature, time.time() - started)
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats,
+                        in_flight=self._in_flight,
+                        queued=len(self._waiting),
+                        max_in_flight=self.max_in_flight,
+                        max_queue=self.max_queue,
+                        wait_ms={f: {"avg": round(w["total_s"] / w["count"] * 1000, 1),
+                                     "max": round(w["max_s"] * 1000, 1)}
+                                 for f, w in self._wait.items()})
+
+
+admission = AdmissionController(int(os.getenv("LLM_MAX_IN_FLIGHT", "8")),
+                                int(os.getenv("LLM_MAX_QUEUE", "32")))
+
+# ==============================================================================
+#                                PUBLIC CALLS
+# ==============================================================================
+
+_stats_lock = threading.Lock()
+_stats = {}   # feature -> {"calls", "errors", "total_s"}
+
+def _record(feature, started, ok):
+    with _stats_lock:
+        s = _stats.setdefault(feature, {"calls": 0, "errors": 0, "total_s": 0.0})
+        s["calls"] += 1
+        s["total_s"] += time.time() - started
+        if not ok:
+            s["errors"] += 1
+
+def _call(feature, method, payload):
+    settings = get_settings(feature)
+    admission.acquire(feature, settings["priority"], settings["max_wait"])
+    started, ok = time.time(), False
+    try:
+        result = getattr(get_backend(), method)(settings, payload)
+        ok = True
+        return result
+    finally:
+        admission.release()
+        _record(feature, started, ok)
+
+def _call_stream(feature, method, payload):
+    # The slot is held until the stream is exhausted or closed.
+    settings = get_settings(feature)
+    admission.acquire(feature, settings["priority"], settings["max_wait"])
+    started, ok = time.time(), False
+    try:
+        yield from getattr(get_backend(), method)(settings, payload)
+        ok = True
+    except GeneratorExit:
+        ok = True   # consumer stopped reading, not an upstream error
+        raise
+    finally:
+        admission.release()
+        _record(feature, started, ok)
+
+# ==============================================================================
+#                      SINGLE-FLIGHT (IN-FLIGHT DEDUPLICATION)
+# ==============================================================================
+# Identical non-streaming calls that arrive while one is already running
+# (a class of 40 asking for the same quiz) wait for that call and share its
+# result instead of each taking a slot and an upstream request.
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_flights_lock = threading.Lock()
+_flights = {}         # key -> _Flight
+_flight_stats = {}    # feature -> {"leaders", "coalesced"}
+
+def _normalize(text):
+    return " ".join(str(text).split())
+
+def request_key(feature, payload):
+    """Hash of (feature, model params, normalized prompt or messages)."""
+    settings = get_settings(feature)
+    if isinstance(payload, (list, tuple)):
+        payload = "\x1e".join(f"{type(m).__name__}:{_normalize(getattr(m, 'content', m))}" for m in payload)
+    raw = "\x1f".join([feature, settings["model"], str(settings["temperature"]), _normalize(payload)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _single_flight(feature, method, payload):
+    key = request_key(feature, payload)
+    with _flights_lock:
+        counters = _flight_stats.setdefault(feature, {"leaders": 0, "coalesced": 0})
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+            counters["leaders"] += 1
+        else:
+            counters["coalesced"] += 1
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _call(feature, method, payload)
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+def generate(feature, prompt):
+    """Single prompt -> full text. Concurrent identical prompts share one call."""
+    return _single_flight(feature, "generate", prompt)
+
+def generate_stream(feature, prompt):
+    """Single prompt -> text chunks as they are produced."""
+    return _call_stream(feature, "generate_stream", prompt)
+
+def invoke_chat(feature, messages):
+    """LangChain message list -> full text. Concurrent identical conversations share one call."""
+    return _single_flight(feature, "invoke_chat", messages)
+
+def stream_chat(feature, messages):
+    """LangChain message list -> text chunks as they are produced."""
+    return _call_stream(feature, "stream_chat", messages)
+
+def get_llm_stats():
+    with _stats_lock:
+        features = {
+            f: {"calls": s["calls"], "errors": s["errors"],
+                "avg_ms": round(s["total_s"] / s["calls"] * 1000, 1) if s["calls"] else 0.0}
+            for f, s in _stats.items()
+        }
+    with _flights_lock:
+        single_flight = {"in_flight": len(_flights),
+                         "features": {f: dict(c) for f, c in _flight_stats.items()}}
+    return {"backend": _backend_name, "models_built": get_backend().models_built(),
+            "features": features, "admission": admission.stats(), "single_flight": single_flight}
@@ -0,0 +1,15 @@
+from conversation_store import db, ensure_indexes, _migrate_legacy
+
+# Moves every conversation still using the old embedded `messages` array into
+# the paged db.messages collection. Safe to run more than once.
+
+print("🔄 Creating indexes...")
+ensure_indexes()
+
+legacy = db.conversations.find({"messages": {"$exists": True}}, {"session_id": 1, "messages": 1})
+count = 0
+for convo in legacy:
+    _migrate_legacy(convo['session_id'], convo.get('messages', []))
+    count += 1
+
+print(f"✅ Migration complete: {count} conversations moved.")
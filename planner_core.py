@@ -1,56 +1,300 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import re
+import unicodedata
+import llm_client
+import response_cache
 
-# 1. Setup
-load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=api_key)
+# ==============================================================================
+#                             STUDY PLAN ENGINE
+# ==============================================================================
+# The timetable is computed locally (build_plan) instead of being written by
+# the LLM: each day has PLAN_BLOCKS_PER_DAY study blocks with short breaks and
+# a lunch break; blocks are shared between subjects in proportion to their
+# weight (x PLAN_GOAL_WEIGHT for subjects named in the goal) and interleaved so
+# the same subject rarely follows itself. From 3 days on, the last day is a
+# general review. When there are more subjects than blocks, the day is cut
+# into more, shorter blocks (down to PLAN_MIN_BLOCK_MIN) so each subject gets
+# one; subjects that still do not fit are listed under the plan. The student's
+# files are matched to subjects by title words and recommended in the blocks
+# of their subject.
+#
+# The structured plan is cached and rendered to the Markdown the study planner
+# page displays. The LLM only adds a short "Conseils" section under the plan
+# (PLAN_LLM_NOTES=0 turns it off); without it the plan is still complete.
 
-# Use the reliable Flash model
-model = genai.GenerativeModel('gemma-3-1b-it')
+PLAN_DAY_START = os.getenv("PLAN_DAY_START", "09:00")
+PLAN_BLOCKS_PER_DAY = int(os.getenv("PLAN_BLOCKS_PER_DAY", "4"))
+PLAN_BLOCK_MIN = int(os.getenv("PLAN_BLOCK_MIN", "90"))
+PLAN_MIN_BLOCK_MIN = int(os.getenv("PLAN_MIN_BLOCK_MIN", "45"))
+PLAN_BREAK_MIN = int(os.getenv("PLAN_BREAK_MIN", "15"))
+PLAN_LUNCH_MIN = int(os.getenv("PLAN_LUNCH_MIN", "60"))
+PLAN_MAX_DAYS = int(os.getenv("PLAN_MAX_DAYS", "60"))
+PLAN_GOAL_WEIGHT = float(os.getenv("PLAN_GOAL_WEIGHT", "2"))
+PLAN_LLM_NOTES = os.getenv("PLAN_LLM_NOTES", "1") == "1"
 
-def generate_study_plan(days, subjects, goal, user_files):
+STUDY_TOPICS = ("Notions fondamentales et définitions", "Approfondissement des chapitres clés",
+                "Exercices d'application")
+SYNTHESIS_TOPIC = "Synthèse et fiche de révision"
+REVIEW_TOPICS = ("Révision des points faibles", "Exercices types examen", "Relecture des fiches de synthèse")
+GENERAL_RESOURCE = "Cours général"
+_STOPWORDS = {"les", "des", "and", "the", "pdf", "pptx", "cours", "chapitre", "chap", "partie", "introduction", "intro",
+              "de", "du", "la", "le", "et", "en", "un", "au", "of", "to", "in", "on", "an"}
+
+def _clean_files(user_files):
+    """Distinct, sorted file titles (materials without a title are skipped)."""
+    return sorted({f for f in user_files or [] if isinstance(f, str) and f.strip()})
+
+def _plan_payload(days, subjects, goal, user_files):
+    return {"days": days, "subjects": subjects, "goal": goal, "files": _clean_files(user_files)}
+
+# ==============================================================================
+#                                   ENGINE
+# ==============================================================================
+
+def _words(text):
+    """Lowercase, accent-free words of 2+ characters (file and subject matching; keeps "IA", "ML")."""
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode().lower()
+    return {w for w in re.split(r"[^a-z0-9]+", text) if len(w) >= 2 and w not in _STOPWORDS}
+
+def _parse_subjects(subjects, goal):
+    """[(name, weight)] from names or {"name", "weight"} dicts; subjects named in the goal weigh more."""
+    goal_words = _words(goal)
+    parsed, seen = [], set()
+    for s in subjects or []:
+        name, weight = (s.get('name'), s.get('weight', 1)) if isinstance(s, dict) else (s, 1)
+        if not name or name in seen:
+            continue
+        seen.add(name)
+        try:
+            weight = max(float(weight), 0.1)
+        except (TypeError, ValueError):
+            weight = 1.0
+        if _words(name) & goal_words:
+            weight *= PLAN_GOAL_WEIGHT
+        parsed.append((name, weight))
+    return parsed
+
+def map_files_to_subjects(user_files, subjects):
+    """{subject: [file, ...]} by shared title words; files matching no subject go under None."""
+    resources = {name: [] for name in subjects}
+    subject_words = {name: _words(name) for name in subjects}
+    for f in _clean_files(user_files):
+        fw = _words(os.path.splitext(f)[0])
+        best = max(subjects, key=lambda n: len(subject_words[n] & fw), default=None)
+        if best is not None and subject_words[best] & fw:
+            resources[best].append(f)
+        else:
+            resources.setdefault(None, []).append(f)
+    return resources
+
+def _allocate(weighted, blocks):
+    """Blocks per subject, proportional to weight (largest remainder), at least one each when possible."""
+    total = sum(w for _, w in weighted)
+    exact = [blocks * w / total for _, w in weighted]
+    counts = [int(x) for x in exact]
+    for i in sorted(range(len(exact)), key=lambda i: (counts[i] - exact[i], i))[:blocks - sum(counts)]:
+        counts[i] += 1
+    for i in range(len(counts)):
+        if counts[i] == 0 and blocks >= len(counts):
+            donor = max(range(len(counts)), key=lambda j: counts[j])
+            counts[donor] -= 1
+            counts[i] = 1
+    return counts
+
+def _interleave(names, counts):
+    """Smooth weighted round-robin: spreads each subject's blocks over the whole plan."""
+    current = [0] * len(names)
+    total = sum(counts)
+    order = []
+    for _ in range(total):
+        for i, c in enumerate(counts):
+            current[i] += c
+        pick = max(range(len(names)), key=lambda i: current[i])
+        current[pick] -= total
+        order.append(names[pick])
+    return order
+
+def _day_blocks(subjects, study_days):
+    """(blocks per day, block minutes): shorter blocks when there are more subjects than blocks."""
+    per_day = PLAN_BLOCKS_PER_DAY
+    if subjects > study_days * per_day:
+        day_min = PLAN_BLOCKS_PER_DAY * PLAN_BLOCK_MIN
+        most = max(per_day, day_min // max(PLAN_MIN_BLOCK_MIN, 1))
+        per_day = min(-(-subjects // study_days), most)
+        return per_day, day_min // per_day
+    return per_day, PLAN_BLOCK_MIN
+
+def _slots(per_day=PLAN_BLOCKS_PER_DAY, block_min=PLAN_BLOCK_MIN):
+    """(start, end, kind) of one day: study blocks, then a break (lunch after the middle block)."""
+    h, m = (int(x) for x in PLAN_DAY_START.split(":"))
+    t = h * 60 + m
+    fmt = lambda minutes: f"{minutes // 60:02d}:{minutes % 60:02d}"
+    slots = []
+    for b in range(per_day):
+        slots.append((fmt(t), fmt(t + block_min), "study"))
+        t += block_min
+        if b == per_day - 1:
+            break
+        pause = PLAN_LUNCH_MIN if b == max(per_day // 2, 1) - 1 else PLAN_BREAK_MIN
+        slots.append((fmt(t), fmt(t + pause), "lunch" if pause == PLAN_LUNCH_MIN else "break"))
+        t += pause
+    return slots
+
+def _topic(k, n):
+    """Topic of a subject's k-th of n blocks: basics first, synthesis last, practice in between."""
+    if n > 1 and k == n - 1:
+        return SYNTHESIS_TOPIC
+    return STUDY_TOPICS[0] if k == 0 else STUDY_TOPICS[1 + (k + 1) % 2]
+
+def build_plan(days, subjects, goal, user_files):
     """
-    Generates a text-based study plan (Markdown) compatible with the frontend.
+    Structured study plan: {"days", "goal", "subjects": [{"name", "weight",
+    "blocks", "resources"}], "unscheduled", "other_resources", "schedule":
+    [{"day", "theme", "blocks": [{"start", "end", "kind", "subject", "topic",
+    "resource"}]}]}. "unscheduled" lists the subjects that got no block.
     """
-    if not api_key:
-        return "⚠️ Erreur: Clé API Google manquante."
+    try:
+        days = min(max(int(days), 1), PLAN_MAX_DAYS)
+    except (TypeError, ValueError):
+        days = 7
+    weighted = _parse_subjects(subjects, goal)
+    names = [n for n, _ in weighted]
+    resources = map_files_to_subjects(user_files, names)
 
-    # Format the list of files for the AI
-    files_context = ", ".join(user_files) if user_files else "Aucun fichier spécifique téléversé."
-    subjects_str = ", ".join(subjects)
+    review_day = days >= 3 and len(names) > 0
+    per_day, block_min = _day_blocks(len(names), days - review_day)
+    slots = _slots(per_day, block_min)
+    study_blocks = (days - review_day) * per_day
+    counts = _allocate(weighted, study_blocks) if names else []
+    order = iter(_interleave(names, counts) if names else [])
+    seen = {n: 0 for n in names}
+    per_subject = dict(zip(names, counts))
 
-    prompt = f"""
+    schedule = []
+    for d in range(days):
+        is_review = review_day and d == days - 1
+        blocks, studied, slot = [], [], 0
+        for start, end, kind in slots:
+            block = {"start": start, "end": end, "kind": kind}
+            if kind == "study":
+                if is_review:
+                    name = names[slot % len(names)]
+                    block.update(kind="review", subject=name, topic=REVIEW_TOPICS[slot % len(REVIEW_TOPICS)])
+                else:
+                    name = next(order, None)
+                    if name:
+                        block.update(subject=name, topic=_topic(seen[name], per_subject[name]))
+                        seen[name] += 1
+                    else:
+                        block.update(kind="free", subject=None, topic="Temps libre / rattrapage")
+                if name:
+                    files = resources.get(name) or []
+                    block["resource"] = files[(seen[name] - 1 if not is_review else 0) % len(files)] if files else GENERAL_RESOURCE
+                    if name not in studied:
+                        studied.append(name)
+                slot += 1
+            blocks.append(block)
+        theme = "Révision générale" if is_review else (" & ".join(studied[:3]) or "Repos")
+        schedule.append({"day": d + 1, "theme": theme, "blocks": blocks})
+
+    return {
+        "days": days,
+        "goal": goal,
+        "subjects": [{"name": n, "weight": round(w, 2), "blocks": per_subject.get(n, 0), "resources": resources[n]}
+                     for n, w in weighted],
+        "unscheduled": [n for n in names if not per_subject.get(n)],
+        "other_resources": resources.get(None, []),
+        "schedule": schedule,
+    }
+
+def render_plan(plan):
+    """Markdown of a structured plan, in the format the study planner page displays."""
+    lines = [f"## Plan de révision sur {plan['days']} jour{'s' if plan['days'] > 1 else ''}"]
+    if plan.get('goal'):
+        lines.append(f"**Objectif :** {plan['goal']}")
+    if not plan['subjects']:
+        lines.append("\nAucune matière sélectionnée.")
+        return "\n".join(lines)
+    for day in plan['schedule']:
+        lines.append(f"\n### Jour {day['day']} : {day['theme']}")
+        for b in day['blocks']:
+            if b['kind'] == "break":
+                lines.append(f"* **{b['start']} - {b['end']} :** Pause")
+            elif b['kind'] == "lunch":
+                lines.append(f"* **{b['start']} - {b['end']} :** Pause déjeuner")
+            elif b['kind'] == "free":
+                lines.append(f"* **{b['start']} - {b['end']} :** {b['topic']}")
+            else:
+                lines.append(f"* **{b['start']} - {b['end']} :** {b['subject']} - {b['topic']}")
+                lines.append(f"    * *Ressource recommandée :* {b['resource']}")
+    if plan.get('unscheduled'):
+        lines.append(f"\n*Matières non planifiées faute de temps :* {', '.join(plan['unscheduled'])}")
+    if plan.get('other_resources'):
+        lines.append(f"\n*Autres fichiers disponibles :* {', '.join(plan['other_resources'])}")
+    return "\n".join(lines)
+
+def get_plan(days, subjects, goal, user_files):
+    """Cached structured plan (the engine is cheap, the cache keeps identical requests identical)."""
+    return response_cache.get_or_compute(
+        "planner", _plan_payload(days, subjects, goal, user_files),
+        lambda: build_plan(days, subjects, goal, user_files), options={"part": "plan"})
+
+# ==============================================================================
+#                              LLM ANNOTATION
+# ==============================================================================
+
+def _notes_prompt(plan):
+    subjects = "; ".join(
+        f"{s['name']} ({s['blocks']} séances, fichiers: {', '.join(s['resources']) or 'aucun'})" for s in plan['subjects'])
+    return f"""
     Agis en tant qu'expert en planification académique.
-    Crée un plan de révision pour un étudiant universitaire.
-    
+    Un étudiant universitaire suit un plan de révision déjà établi.
+
     **CONTEXTE:**
-    - Durée: {days} jours.
-    - Matières à réviser: {subjects_str}.
-    - Objectif principal: {goal}.
-    - Ressources disponibles (PDFs de l'étudiant): [{files_context}].
-    
+    - Durée: {plan['days']} jours.
+    - Objectif principal: {plan['goal']}.
+    - Répartition: {subjects}.
+
     **INSTRUCTIONS:**
-    1. Crée un emploi du temps jour par jour.
-    2. Sois précis (ex: "Jour 1: 09h00 - 11h00 : Titre du chapitre").
-    3. IMPORTANT: Si une matière correspond à un des fichiers PDF listés ci-dessus, dis explicitement à l'étudiant de lire ce fichier.
-    4. Utilise un format clair et lisible (Markdown).
-    5. Inclus des pauses.
-
-    **FORMAT DE RÉPONSE ATTENDU (Markdown):**
-    
-    ### Jour 1 : [Thème]
-    * **09:00 - 11:00 :** [Matière] - [Sujet précis]
-        * *Ressource recommandée :* [Nom du fichier PDF si applicable, sinon "Cours général"]
-    * **11:00 - 11:15 :** Pause
-    ...
+    Donne 3 à 5 conseils courts et concrets pour réussir ce plan (méthode, priorités, fichiers à lire).
+    Ne réécris pas l'emploi du temps. Réponds en Markdown, une liste à puces, sans introduction.
     """
 
+def _notes_wanted(plan):
+    return PLAN_LLM_NOTES and plan['subjects'] and llm_client.is_available()
+
+def generate_study_plan(days, subjects, goal, user_files):
+    """
+    Generates a text-based study plan (Markdown) compatible with the frontend.
+    """
+    plan = get_plan(days, subjects, goal, user_files)
+    text = render_plan(plan)
+    if not _notes_wanted(plan):
+        return text
+    try:
+        notes = response_cache.get_or_compute(
+            "planner", _plan_payload(days, subjects, goal, user_files),
+            lambda: llm_client.generate("planner", _notes_prompt(plan)), options={"part": "notes"})
+        return f"{text}\n\n### Conseils\n{notes.strip()}"
+    except Exception as e:
+        # The plan is complete without the notes
+        print(f"⚠️ Planner Notes Error: {e}")
+        return text
+
+def stream_study_plan(days, subjects, goal, user_files):
+    """Same as generate_study_plan: the plan comes in one piece, then the notes chunk by chunk."""
+    plan = get_plan(days, subjects, goal, user_files)
+    yield render_plan(plan)
+    if not _notes_wanted(plan):
+        return
     try:
-        response = model.generate_content(prompt)
-        # Return the raw text so the frontend can display it properly
-        return response.text
+        first = True
+        for chunk in response_cache.stream_or_compute(
+                "planner", _plan_payload(days, subjects, goal, user_files),
+                lambda: llm_client.generate_stream("planner", _notes_prompt(plan)), options={"part": "notes"}):
+            yield ("\n\n### Conseils\n" + chunk.lstrip()) if first else chunk
+            first = False
+    except GeneratorExit:
+        raise
     except Exception as e:
-        print(f"❌ Planner Error: {e}")
-        return "Désolé, une erreur est survenue lors de la génération du planning. Veuillez réessayer."
\ No newline at end of file
+        print(f"⚠️ Planner Notes Error: {e}")
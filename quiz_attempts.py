@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from quiz_core import grade_quiz_batch, grading_result
+import quiz_store
+
+# ==============================================================================
+#                         QUIZ ATTEMPTS & CLASS ANALYTICS
+# ==============================================================================
+# Every /api/quiz/submit is stored in db.quiz_attempts with its per-question
+# correctness. The same submit bumps two counter documents with $inc:
+#   db.quiz_stats        one per quiz: attempts, score sum, correct/answered per question
+#   db.quiz_class_stats  one per (subject, major): attempts, score sum, passes,
+#                        score histogram (10 buckets), questions answered/correct
+# so the teacher analytics routes read one document instead of re-grading.
+#
+# Grading goes through quiz_core.grade_quiz_batch (NumPy over the answer
+# matrix). rebuild_stats() re-grades all stored attempts quiz by quiz in one
+# batch each and rewrites the counters, e.g. after a correction of a quiz.
+#
+# Usage: python quiz_attempts.py --rebuild
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+try:
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client["chatbot_ai_app"]
+except Exception as e:
+    print(f"❌ Quiz Attempts DB Error: {e}")
+
+PASS_SCORE = int(os.getenv("QUIZ_PASS_SCORE", "50"))
+
+_indexes_ready = False
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    db.quiz_attempts.create_index([("quiz_id", ASCENDING), ("submitted_at", ASCENDING)])
+    db.quiz_attempts.create_index([("user_id", ASCENDING), ("submitted_at", DESCENDING)])
+    _indexes_ready = True
+
+def class_key(subject, major):
+    return f"{subject}|{major}"
+
+def _bucket(score):
+    return min(int(score) // 10, 9)
+
+def _increments(correct, scores):
+    """$inc documents (per quiz, per class) for a batch of graded attempts of one quiz."""
+    answered = correct.shape[0]
+    per_question = correct.sum(axis=0)
+    quiz_inc = {"attempts": answered, "score_sum": int(scores.sum())}
+    for i, n in enumerate(per_question.tolist()):
+        quiz_inc[f"questions.{i}.answered"] = answered
+        quiz_inc[f"questions.{i}.correct"] = n
+    class_inc = {"attempts": answered, "score_sum": int(scores.sum()),
+                 "passed": int((scores >= PASS_SCORE).sum()),
+                 "questions_answered": int(correct.size), "questions_correct": int(correct.sum())}
+    for score in scores.tolist():
+        key = f"histogram.{_bucket(score)}"
+        class_inc[key] = class_inc.get(key, 0) + 1
+    return quiz_inc, class_inc
+
+def _student_major(user_id):
+    try:
+        student = db.students.find_one({"_id": ObjectId(user_id)}, {"major": 1})
+    except Exception:
+        return None
+    return student.get('major') if student else None
+
+def record_attempt(quiz_id, user_id, answers):
+    """
+    Grades one submission, stores the attempt and updates the counters.
+    Returns the same result as grade_quiz_ai, or None if the quiz is unknown.
+    """
+    quiz = quiz_store.get_quiz(quiz_id)
+    if not quiz:
+        return None
+    ensure_indexes()
+    questions = quiz['questions']
+    correct, scores = grade_quiz_batch(questions, [answers])
+    score = int(scores[0])
+    major = _student_major(user_id)
+
+    db.quiz_attempts.insert_one({
+        "quiz_id": quiz_id, "user_id": user_id, "subject": quiz['subject'], "major": major,
+        "answers": answers, "correct": correct[0].tolist(), "score": score,
+        "total": len(questions), "submitted_at": datetime.now(timezone.utc),
+    })
+    quiz_inc, class_inc = _increments(correct, scores)
+    now = time.time()
+    db.quiz_stats.update_one({"_id": quiz_id},
+                             {"$inc": quiz_inc, "$set": {"subject": quiz['subject'], "major": major,
+                                                          "total": len(questions), "updated_at": now}},
+                             upsert=True)
+    db.quiz_class_stats.update_one({"_id": class_key(quiz['subject'], major)},
+                                   {"$inc": class_inc, "$set": {"subject": quiz['subject'], "major": major,
+                                                                "updated_at": now}},
+                                   upsert=True)
+    return grading_result(questions, score)
+
+# ==============================================================================
+#                                  ANALYTICS
+# ==============================================================================
+
+def _class_view(doc):
+    attempts = doc.get('attempts', 0)
+    answered = doc.get('questions_answered', 0)
+    histogram = doc.get('histogram', {})
+    return {
+        "subject": doc.get('subject'), "major": doc.get('major'), "attempts": attempts,
+        "average_score": round(doc.get('score_sum', 0) / attempts, 1) if attempts else 0.0,
+        "pass_rate": round(doc.get('passed', 0) / attempts, 3) if attempts else 0.0,
+        "question_success_rate": round(doc.get('questions_correct', 0) / answered, 3) if answered else 0.0,
+        "histogram": [histogram.get(str(i), 0) for i in range(10)],
+    }
+
+def get_class_stats(pairs):
+    """Class analytics for [(subject, major), ...], read from the counters (one query)."""
+    docs = {d['_id']: d for d in db.quiz_class_stats.find({"_id": {"$in": [class_key(s, m) for s, m in pairs]}})}
+    return [_class_view(docs.get(class_key(s, m), {"subject": s, "major": m})) for s, m in pairs]
+
+def get_quiz_stats(quiz_id):
+    """Per-question success rates of one quiz, or None if it was never submitted."""
+    doc = db.quiz_stats.find_one({"_id": quiz_id})
+    if not doc:
+        return None
+    quiz = quiz_store.get_quiz(quiz_id)
+    texts = [q.get('question') for q in quiz['questions']] if quiz else []
+    counters = doc.get('questions', {})
+    questions = []
+    for i in range(doc.get('total', len(counters))):
+        c = counters.get(str(i), {})
+        answered = c.get('answered', 0)
+        questions.append({"index": i, "question": texts[i] if i < len(texts) else None,
+                          "answered": answered, "correct": c.get('correct', 0),
+                          "success_rate": round(c.get('correct', 0) / answered, 3) if answered else 0.0})
+    attempts = doc.get('attempts', 0)
+    return {"quiz_id": quiz_id, "subject": doc.get('subject'), "major": doc.get('major'), "attempts": attempts,
+            "average_score": round(doc.get('score_sum', 0) / attempts, 1) if attempts else 0.0,
+            "questions": questions}
+
+def rebuild_stats():
+    """Re-grades every stored attempt (one batch per quiz) and rewrites all counters."""
+    ensure_indexes()
+    started = time.perf_counter()
+    db.quiz_stats.delete_many({})
+    db.quiz_class_stats.delete_many({})
+    graded = 0
+    for quiz_id in db.quiz_attempts.distinct("quiz_id"):
+        quiz = quiz_store.get_quiz(quiz_id)
+        if not quiz:
+            continue
+        attempts = list(db.quiz_attempts.find({"quiz_id": quiz_id}, {"answers": 1, "major": 1}))
+        correct, scores = grade_quiz_batch(quiz['questions'], [a.get('answers') or {} for a in attempts])
+        if attempts:
+            db.quiz_attempts.bulk_write([UpdateOne({"_id": a['_id']}, {"$set": {"correct": row, "score": score}})
+                                         for a, row, score in zip(attempts, correct.tolist(), scores.tolist())],
+                                        ordered=False)
+        by_major = {}
+        for i, a in enumerate(attempts):
+            by_major.setdefault(a.get('major'), []).append(i)
+        for major, rows in by_major.items():
+            quiz_inc, class_inc = _increments(correct[rows], scores[rows])
+            db.quiz_stats.update_one({"_id": quiz_id},
+                                     {"$inc": quiz_inc, "$set": {"subject": quiz['subject'], "major": major,
+                                                                  "total": len(quiz['questions']), "updated_at": time.time()}},
+                                     upsert=True)
+            db.quiz_class_stats.update_one({"_id": class_key(quiz['subject'], major)},
+                                           {"$inc": class_inc, "$set": {"subject": quiz['subject'], "major": major,
+                                                                        "updated_at": time.time()}},
+                                           upsert=True)
+        graded += len(attempts)
+    return {"attempts": graded, "seconds": round(time.perf_counter() - started, 2)}
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv[1:]:
+        r = rebuild_stats()
+        print(f"✅ Re-graded {r['attempts']} attempts in {r['seconds']} s")
+    else:
+        print("Usage: python quiz_attempts.py --rebuild")
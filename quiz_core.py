@@ -1,44 +1,8 @@
-import os
 import json
 import re
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-# 1. SETUP
-load_dotenv()
-
-api_key = os.getenv("GOOGLE_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
-else:
-    print("⚠️ GOOGLE_API_KEY missing in .env")
-
-# Use the model you specified
-# Note: If 'gemini-2.5-flash' throws an error, try 'gemini-1.5-flash'
-try:
-    model = genai.GenerativeModel('gemma-3-1b-it')
-except:
-    model = genai.GenerativeModel('gemma-3-1b-it')
-
-def clean_json_response(text):
-    """
-    Cleans Gemini response to ensure valid JSON.
-    Removes Markdown (```json ... ```) and extra text.
-    """
-    try:
-        # Remove Markdown backticks
-        text = re.sub(r'```json\s*', '', text)
-        text = re.sub(r'```', '', text)
-        
-        # Extract content between first { and last }
-        start = text.find('{')
-        end = text.rfind('}')
-        
-        if start != -1 and end != -1:
-            return text[start:end+1]
-        return text.strip()
-    except:
-        return text
+import numpy as np
+import llm_client
+import response_cache
 
 def get_mock_quiz(subject):
     """Fallback if AI fails."""
@@ -56,14 +20,136 @@ def get_mock_quiz(subject):
         ]
     }
 
-def generate_quiz_ai(subject, difficulty, language):
+def is_valid_question(q):
+    """True if the question has text, at least two options and a correct answer among them."""
+    options = q.get("options")
+    return bool(q.get("question")) and isinstance(options, list) and len(options) >= 2 \
+        and q.get("correct_answer") in options
+
+
+class QuizStreamParser:
     """
-    Generates a quiz using Google Gemini.
+    Incremental, tolerant parser for the quiz JSON the model produces.
+    feed(chunk) returns the questions whose object closed within that chunk, so
+    a caller can forward question 1 while the model is still writing question 2.
+    It scans braces outside of strings instead of parsing the whole document:
+    code fences and prose around the JSON are ignored, a malformed or invalid
+    question is skipped (counted in `skipped`) without losing the others, and an
+    unfinished question at the end of the output is never returned (finish()
+    counts it as skipped and returns the questions still held back).
+
+    Strings are only tracked inside an object, so quotes in the prose before
+    the JSON do not matter. An unescaped quote inside a question inverts the
+    string state; a new question object ({"id" or {"question") resets it and
+    the broken question is counted as skipped.
     """
-    if not api_key:
-        return get_mock_quiz(subject)
 
-    prompt = f"""
+    _QUESTION_START = re.compile(r'\{\s*"(?:id|question)"\s*:')
+    _LOOKAHEAD = 20   # chars needed after a "{" to recognize a question start
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.stack = []        # [start offset, has nested object] of each open object
+        self.in_string = False
+        self.escape = False
+        self.questions = []
+        self.skipped = 0
+        self.subject = None
+        self.final = False
+
+    @staticmethod
+    def _load(raw):
+        for candidate in (raw, re.sub(r",\s*([}\]])", r"\1", raw)):   # 2nd try: without trailing commas
+            try:
+                return json.loads(candidate, strict=False)
+            except ValueError:
+                continue
+        return None
+
+    def _resync(self, i):
+        """A question starts at i while inside a string: drop the open questions it interrupts."""
+        self.in_string = self.escape = False
+        while self.stack and self._QUESTION_START.match(self.text, self.stack[-1][0]):
+            self.stack.pop()
+            self.skipped += 1
+
+    def feed(self, chunk):
+        self.text += chunk
+        found = []
+        text = self.text
+        end = len(text)
+        for i in range(self.pos, len(text)):
+            c = text[i]
+            if c == "{" and self.in_string:
+                if not self.final and len(text) - i < self._LOOKAHEAD:
+                    end = i   # not enough text yet to tell a question start from string content
+                    break
+                if self._QUESTION_START.match(text, i):
+                    self._resync(i)
+            if not self.stack:
+                if c == "{":
+                    self.stack.append([i, False])
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "{":
+                if self.stack:
+                    self.stack[-1][1] = True
+                self.stack.append([i, False])
+            elif c == "}" and self.stack:
+                start, has_children = self.stack.pop()
+                obj = self._load(text[start:i + 1])
+                if isinstance(obj, dict) and "question" in obj:
+                    if is_valid_question(obj):
+                        found.append(obj)
+                    else:
+                        self.skipped += 1
+                elif isinstance(obj, dict) and "questions" in obj:
+                    self.subject = obj.get("subject") or self.subject
+                elif obj is None and not has_children and '"question"' in text[start:i + 1]:
+                    self.skipped += 1   # broken question object
+        self.pos = end
+        self.questions.extend(found)
+        return found
+
+    def finish(self):
+        """End of output: returns the questions still held back; open ones were cut off, counted as skipped."""
+        self.final = True
+        found = self.feed("")
+        self.skipped += sum(1 for start, _ in self.stack if self._QUESTION_START.match(self.text, start))
+        self.stack = []
+        return found
+
+
+def _parse_quiz(text, subject):
+    """(quiz, number of questions dropped) of a model output; raises ValueError if no question is valid."""
+    parser = QuizStreamParser()
+    parser.feed(text)
+    parser.finish()
+    if not parser.questions:
+        raise ValueError("No valid question in the model output")
+    if parser.skipped:
+        print(f"⚠️ Quiz: {parser.skipped} malformed question(s) dropped, {len(parser.questions)} kept")
+    questions = parser.questions
+    # Ensure IDs are strings
+    for i, q in enumerate(questions):
+        q['id'] = str(i)
+    return {"subject": parser.subject or subject, "questions": questions}, parser.skipped
+
+def parse_quiz(text, subject):
+    """Every well-formed question found in the model output; raises ValueError if there is none."""
+    return _parse_quiz(text, subject)[0]
+
+def _quiz_prompt(subject, difficulty, language, variant=None):
+    variant_line = f"- Variant: {variant} (write different questions than other variants of this quiz)" if variant else ""
+    return f"""
     Act as a professional Quiz Generator API.
     
     Task: Create a multiple-choice quiz.
@@ -71,6 +157,7 @@ def generate_quiz_ai(subject, difficulty, language):
     - Difficulty: {difficulty}
     - Language: {language}
     - Question Count: 5
+    {variant_line}
     
     OUTPUT FORMAT REQUIREMENTS:
     1. Return ONLY raw JSON. No markdown, no intro text.
@@ -90,55 +177,129 @@ def generate_quiz_ai(subject, difficulty, language):
     }}
     """
 
-    try:
-        # Call Gemini
-        response = model.generate_content(prompt)
-        
-        # Clean and Parse
-        cleaned_text = clean_json_response(response.text)
-        quiz_data = json.loads(cleaned_text)
+def build_quiz(subject, difficulty, language, variant=None, feature="quiz"):
+    """
+    One quiz straight from the LLM (no cache, no fallback: errors raise), keeping
+    every valid question. A variant tag asks for a different set of questions,
+    used by the quiz pool.
+    """
+    return _generate_quiz(subject, difficulty, language, variant, feature)[0]
+
+def _generate_quiz(subject, difficulty, language, variant=None, feature="quiz"):
+    response_text = llm_client.generate(feature, _quiz_prompt(subject, difficulty, language, variant))
+    return _parse_quiz(response_text, subject)
+
+def stream_quiz_questions(subject, difficulty, language):
+    """
+    Yields each validated question (with its id) as soon as the model has
+    finished writing it. A complete quiz (no question dropped) is cached under
+    generate_quiz_ai's key, and
+    a cached one is replayed at once. Errors propagate.
+    """
+    payload = {"subject": subject, "difficulty": difficulty, "language": language}
+    key = response_cache.cache_key("quiz", payload)
+    cached = response_cache.lookup("quiz", key) if response_cache.is_enabled("quiz") else response_cache.MISSING
+    if cached is not response_cache.MISSING:
+        yield from cached["questions"]
+        return
 
-        # Validate Structure
-        if "questions" not in quiz_data:
-            raise ValueError("Missing 'questions' key")
+    parser = QuizStreamParser()
+    questions = []
+    for chunk in llm_client.generate_stream("quiz", _quiz_prompt(subject, difficulty, language)):
+        for q in parser.feed(chunk):
+            q['id'] = str(len(questions))
+            questions.append(q)
+            yield q
+    for q in parser.finish():
+        q['id'] = str(len(questions))
+        questions.append(q)
+        yield q
+    if questions and not parser.skipped and response_cache.is_enabled("quiz"):
+        response_cache.store("quiz", key, {"subject": parser.subject or subject, "questions": questions})
 
-        # Ensure IDs are strings
-        for i, q in enumerate(quiz_data['questions']):
-            q['id'] = str(i)
+def generate_quiz_ai(subject, difficulty, language):
+    """
+    Generates a quiz using Google Gemini.
+    """
+    if not llm_client.is_available():
+        return get_mock_quiz(subject)
 
-        return quiz_data
+    try:
+        # Only complete quizzes are cached (no question dropped), never the mock fallback
+        if not response_cache.is_enabled("quiz"):
+            return build_quiz(subject, difficulty, language)
+        key = response_cache.cache_key("quiz", {"subject": subject, "difficulty": difficulty, "language": language})
+        cached = response_cache.lookup("quiz", key)
+        if cached is not response_cache.MISSING:
+            return cached
+        quiz, skipped = _generate_quiz(subject, difficulty, language)
+        if not skipped:
+            response_cache.store("quiz", key, quiz)
+        return quiz
 
+    except llm_client.LLMBusyError:
+        raise
     except Exception as e:
         print(f"❌ Gemini Error: {e}")
         return get_mock_quiz(subject)
 
+def grade_quiz_batch(questions, submissions):
+    """
+    Grades many answer sets ({question_id: answer}) of the same quiz at once.
+    Answers and correct answers are mapped to ids of one shared vocabulary, so
+    grading is a single comparison of the (submissions x questions) answer
+    matrix with the key row. Returns (correct, scores): the boolean matrix and
+    each submission's percentage.
+    """
+    vocab = {}
+    key = np.array([vocab.setdefault((q.get('correct_answer') or "").strip(), len(vocab)) for q in questions],
+                   dtype=np.int32)
+    ids = [str(q.get('id')) for q in questions]
+    answers = np.array([[vocab.get((sub.get(q_id) or "").strip(), -1) for q_id in ids] for sub in submissions],
+                       dtype=np.int32).reshape(len(submissions), len(ids))
+    correct = answers == key
+    scores = np.rint(correct.sum(axis=1) * 100 / len(ids)).astype(int) if ids else np.zeros(len(submissions), dtype=int)
+    return correct, scores
+
+def grading_result(questions, score):
+    """Response of /api/quiz/submit: score, total and the correction of each question."""
+    return {
+        "score": int(score),
+        "total": len(questions),
+        "corrections": [{
+            "question_id": str(q.get('id')),
+            "correct_answer": (q.get('correct_answer') or "").strip(),
+            "explanation": q.get('explanation', '')
+        } for q in questions]
+    }
+
 def grade_quiz_ai(quiz_content, user_answers):
     """
     Grades the quiz (Logic remains the same, no AI needed here).
     """
     questions = quiz_content.get('questions', []) if isinstance(quiz_content, dict) else quiz_content
-    score = 0
-    corrections = []
-
-    for q in questions:
-        q_id = str(q.get('id'))
-        user_ans = (user_answers.get(q_id) or "").strip()
-        correct_ans = (q.get('correct_answer') or "").strip()
+    _, scores = grade_quiz_batch(questions, [user_answers])
+    return grading_result(questions, scores[0])
 
-        is_correct = (user_ans == correct_ans)
-        if is_correct: score += 1
-
-        corrections.append({
-            "question_id": q_id,
-            "correct_answer": correct_ans,
-            "explanation": q.get('explanation', '')
-        })
+def _stub_quiz(prompt):
+    """Offline quiz JSON for the stub LLM backend (same shape Gemini is asked for)."""
+    match = re.search(r'Subject: "(.*?)"', prompt)
+    subject = match.group(1) if match else "Quiz"
+    return json.dumps({
+        "subject": subject,
+        "questions": [
+            {
+                "id": str(i),
+                "question": f"Question {i + 1} sur {subject} ?",
+                "options": ["Option A", "Option B", "Option C", "Option D"],
+                "correct_answer": ["Option A", "Option B", "Option C", "Option D"][i % 4],
+                "hint": "Mode hors ligne.",
+                "explanation": "Quiz généré par le backend local."
+            }
+            for i in range(5)
+        ]
+    }, ensure_ascii=False)
 
-    total = len(questions)
-    percentage = round((score / total) * 100) if total > 0 else 0
+llm_client.set_stub_responder("quiz", _stub_quiz)
+llm_client.set_stub_responder("quiz_pool", _stub_quiz)
 
-    return {
-        "score": percentage,
-        "total": total,
-        "corrections": corrections
-    }
\ No newline at end of file
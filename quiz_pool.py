@@ -0,0 +1,151 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from pymongo import MongoClient, ReturnDocument, ASCENDING, DESCENDING
+from dotenv import load_dotenv
+from workers import WorkerPool
+import llm_client
+from quiz_core import build_quiz
+
+# ==============================================================================
+#                           PRE-GENERATED QUIZ POOL
+# ==============================================================================
+# /api/quiz/generate takes a ready quiz from db.quiz_pool (one atomic
+# find_one_and_delete) and only generates live on a miss. Only popular keys are
+# pre-generated: a take schedules a refill of that (subject, difficulty,
+# language) key back to QUIZ_POOL_TARGET quizzes once the key has been asked
+# QUIZ_POOL_MIN_REQUESTS times, or when it was a hit (the key is already pooled,
+# e.g. warmed at startup). A one-off key costs no extra generation. Refills run
+# on background workers at the lowest LLM priority ("quiz_pool"), so they never
+# hold up live requests.
+#
+# Demand per key is counted in db.quiz_pool_keys. warm_quiz_pool() tops up the
+# QUIZ_POOL_KEYS most requested keys, or every subject of db.subjects at the
+# default difficulty/language while there is no history yet.
+# QUIZ_POOL_TARGET=0 turns the pool off.
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+try:
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client["chatbot_ai_app"]
+except Exception as e:
+    print(f"❌ Quiz Pool DB Error: {e}")
+
+QUIZ_POOL_TARGET = int(os.getenv("QUIZ_POOL_TARGET", "3"))
+QUIZ_POOL_KEYS = int(os.getenv("QUIZ_POOL_KEYS", "30"))
+QUIZ_POOL_MIN_REQUESTS = int(os.getenv("QUIZ_POOL_MIN_REQUESTS", "3"))
+QUIZ_POOL_WORKERS = int(os.getenv("QUIZ_POOL_WORKERS", "2"))
+QUIZ_POOL_MAX_AGE = int(os.getenv("QUIZ_POOL_MAX_AGE", str(7 * 24 * 3600)))   # unused quizzes expire
+DEFAULT_DIFFICULTY = "Moyen"
+DEFAULT_LANGUAGE = "French"
+
+refill_pool = WorkerPool("quiz-pool", workers=QUIZ_POOL_WORKERS, max_queue=200)
+
+_pending = set()   # keys with a refill queued or running in this process
+_lock = threading.Lock()
+_stats = {"generated": 0, "failed": 0, "busy": 0}
+_indexes_ready = False
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    db.quiz_pool.create_index([("key", ASCENDING), ("created_at", ASCENDING)])
+    db.quiz_pool.create_index("created_at", expireAfterSeconds=QUIZ_POOL_MAX_AGE)
+    db.quiz_pool_keys.create_index([("requests", DESCENDING)])
+    _indexes_ready = True
+
+def pool_key(subject, difficulty, language):
+    return f"{subject}|{difficulty}|{language}"
+
+def take_quiz(subject, difficulty, language):
+    """A ready quiz for this key (removed from the pool), or None on a miss."""
+    if QUIZ_POOL_TARGET <= 0:
+        return None
+    ensure_indexes()
+    key = pool_key(subject, difficulty, language)
+    doc = db.quiz_pool.find_one_and_delete({"key": key}, sort=[("created_at", ASCENDING)])
+    counts = db.quiz_pool_keys.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"requests": 1, "hits" if doc else "misses": 1},
+         "$set": {"subject": subject, "difficulty": difficulty, "language": language, "last_requested": time.time()}},
+        projection={"requests": 1}, upsert=True, return_document=ReturnDocument.AFTER)
+    if doc or counts['requests'] >= QUIZ_POOL_MIN_REQUESTS:
+        schedule_refill(subject, difficulty, language)
+    return doc['content'] if doc else None
+
+def schedule_refill(subject, difficulty, language):
+    """Queues a top-up of this key unless one is already pending. Returns True if queued."""
+    key = pool_key(subject, difficulty, language)
+    with _lock:
+        if key in _pending:
+            return False
+        _pending.add(key)
+    if not refill_pool.submit(_refill, subject, difficulty, language):
+        with _lock:
+            _pending.discard(key)
+        return False
+    return True
+
+def _refill(subject, difficulty, language):
+    key = pool_key(subject, difficulty, language)
+    try:
+        if not llm_client.is_available():
+            return
+        missing = QUIZ_POOL_TARGET - db.quiz_pool.count_documents({"key": key})
+        for _ in range(max(0, missing)):
+            content = build_quiz(subject, difficulty, language, variant=uuid.uuid4().hex[:8], feature="quiz_pool")
+            db.quiz_pool.insert_one({"key": key, "content": content, "created_at": datetime.now(timezone.utc)})
+            with _lock:
+                _stats["generated"] += 1
+    except llm_client.LLMBusyError:
+        with _lock:
+            _stats["busy"] += 1   # live traffic has the LLM: the next take retries
+    except Exception as e:
+        print(f"❌ Quiz Pool Refill Error ({key}): {e}")
+        with _lock:
+            _stats["failed"] += 1
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+def warm_quiz_pool(limit=None):
+    """Schedules refills for the most requested keys (or all subjects at default settings)."""
+    if QUIZ_POOL_TARGET <= 0:
+        return 0
+    ensure_indexes()
+    limit = limit or QUIZ_POOL_KEYS
+    keys = [(k['subject'], k['difficulty'], k['language'])
+            for k in db.quiz_pool_keys.find({}, {"subject": 1, "difficulty": 1, "language": 1})
+                                      .sort("requests", DESCENDING).limit(limit)]
+    if len(keys) < limit:
+        for name in db.subjects.distinct("name"):
+            if len(keys) >= limit:
+                break
+            if (name, DEFAULT_DIFFICULTY, DEFAULT_LANGUAGE) not in keys:
+                keys.append((name, DEFAULT_DIFFICULTY, DEFAULT_LANGUAGE))
+    scheduled = sum(1 for k in keys if schedule_refill(*k))
+    print(f"🧠 Quiz pool: refilling {scheduled} keys")
+    return scheduled
+
+def get_quiz_pool_stats():
+    fill = {row['_id']: row['n'] for row in db.quiz_pool.aggregate([{"$group": {"_id": "$key", "n": {"$sum": 1}}}])}
+    keys = list(db.quiz_pool_keys.find({}, {"requests": 1, "hits": 1, "misses": 1})
+                                 .sort("requests", DESCENDING).limit(QUIZ_POOL_KEYS))
+    hits = sum(k.get('hits', 0) for k in keys)
+    requests = sum(k.get('requests', 0) for k in keys)
+    with _lock:
+        counters = dict(_stats, pending=len(_pending))
+    return {
+        "target": QUIZ_POOL_TARGET,
+        "ready": sum(fill.values()),
+        "hit_rate": round(hits / requests, 3) if requests else 0.0,
+        "keys": [{"key": k['_id'], "ready": fill.get(k['_id'], 0), "requests": k.get('requests', 0),
+                  "hit_rate": round(k.get('hits', 0) / k['requests'], 3) if k.get('requests') else 0.0} for k in keys],
+        "refills": counters,
+        "workers": refill_pool.stats(),
+    }
@@ -0,0 +1,97 @@
+import os
+import json
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from response_cache import LRUCache, MISSING
+
+# ==============================================================================
+#                          READ-THROUGH QUIZ CACHE
+# ==============================================================================
+# get_quiz, /api/quiz/hint and /api/quiz/submit all need the same quiz. The
+# first of them reads it from db.quizzes (unique index on quiz_id), normalizes
+# its content (JSON string, dict or bare list) once and keeps two views in an
+# in-process LRU: "public" (no correct_answer, sent to the browser) and
+# "questions" (full, used for hints and grading). A quiz session then costs a
+# single database read. Quizzes still being streamed are not cached.
+#
+# Environment:
+#   QUIZ_CACHE_SIZE   max quizzes kept in memory
+#   QUIZ_CACHE_TTL    seconds a quiz stays cached
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+try:
+    client = MongoClient(os.getenv("MONGO_URI"))
+    db = client["chatbot_ai_app"]
+except Exception as e:
+    print(f"❌ Quiz Store DB Error: {e}")
+
+QUIZ_CACHE_SIZE = int(os.getenv("QUIZ_CACHE_SIZE", "1000"))
+QUIZ_CACHE_TTL = int(os.getenv("QUIZ_CACHE_TTL", "3600"))
+
+_quizzes = LRUCache(QUIZ_CACHE_SIZE, QUIZ_CACHE_TTL)
+_indexes_ready = False
+
+def ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    try:
+        db.quizzes.create_index("quiz_id", unique=True)
+    except PyMongoError as e:
+        print(f"⚠️ Quiz index not created: {e}")
+    _indexes_ready = True
+
+def normalize_content(content):
+    """(subject, questions) of a stored quiz, whatever shape its content was saved in."""
+    if isinstance(content, str):
+        try: content = json.loads(content)
+        except ValueError: content = {}
+    if isinstance(content, dict):
+        questions, subject = content.get('questions', []), content.get('subject', 'Quiz')
+    elif isinstance(content, list):
+        questions, subject = content, "Quiz"
+    else:
+        questions, subject = [], "Erreur de format"
+    return subject, [q for q in questions if isinstance(q, dict)]
+
+def _views(doc):
+    subject, questions = normalize_content(doc.get('content', {}))
+    return {
+        "subject": subject,
+        "questions": questions,
+        "public": [{k: v for k, v in q.items() if k != 'correct_answer'} for q in questions],
+        "user_id": doc.get('user_id'),
+        "status": doc.get('status', 'ready'),
+    }
+
+def get_quiz(quiz_id):
+    """
+    Cached views of a quiz ({"subject", "questions", "public", "user_id",
+    "status"}), or None if it does not exist. Shared objects: do not mutate.
+    """
+    if not quiz_id:
+        return None
+    quiz = _quizzes.get(quiz_id)
+    if quiz is not MISSING:
+        return quiz
+    ensure_indexes()
+    doc = db.quizzes.find_one({"quiz_id": quiz_id}, {"_id": 0, "content": 1, "user_id": 1, "status": 1})
+    if not doc:
+        return None
+    quiz = _views(doc)
+    if quiz['status'] != "generating":
+        _quizzes.set(quiz_id, quiz)
+    return quiz
+
+def save_quiz(quiz_id, user_id, content):
+    """Stores a finished quiz and primes the cache with it."""
+    ensure_indexes()
+    doc = {"quiz_id": quiz_id, "user_id": user_id, "content": content}
+    db.quizzes.insert_one(dict(doc))
+    _quizzes.set(quiz_id, _views(doc))
+
+def get_quiz_cache_stats():
+    return _quizzes.stats()
@@ -1,84 +1,574 @@
+import io
 import os
+import shutil
+import hashlib
+import tempfile
 import time
+import threading
 import pypdf
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pymongo import MongoClient
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
+from search_index import BM25Index, SYSTEM_SCOPE
+from vector_index import VectorIndex
 
 load_dotenv()
 client = MongoClient(os.getenv("MONGO_URI"))
 db = client["chatbot_ai_app"]
 
-# --- THIS FUNCTION WAS MISSING OR NOT EXPORTED ---
+base_dir = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(base_dir, "index_data")
+SEARCH_INDEX_PATH = os.path.join(INDEX_DIR, "search_index.pkl")
+# Bump when what gets indexed changes; older snapshots are then rebuilt.
+INDEX_FORMAT = 2   # 2 = one index document per chunk
+# How often a process picks up materials indexed by other processes/scripts.
+INDEX_SYNC_INTERVAL = int(os.getenv("INDEX_SYNC_INTERVAL", "30"))
+
+# Chunking: documents are stored and indexed as overlapping word windows so
+# retrieval can return the passage that matches instead of the document start.
+CHUNK_WORDS = int(os.getenv("CHUNK_WORDS", "200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "40"))
+SEARCH_TOP_PASSAGES = 3
+# Hybrid retrieval: BM25 and vector candidates merged by reciprocal rank fusion.
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+
+# PDF extraction limits. Pages past PDF_MAX_PAGES are dropped (with a warning);
+# files over PDF_MAX_BYTES are refused. Documents with at least
+# PDF_PARALLEL_MIN_PAGES pages are split into page ranges extracted by a
+# process pool of PDF_WORKERS processes. It is off by default (0 or 1): turn it
+# on only where bench_pdf.py shows a gain on the host. Workers are given a file
+# path, never the PDF bytes: uploads are spooled to a temporary file once and
+# each worker opens it itself.
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+
+# ==============================================================================
+#                                PDF EXTRACTION
+# ==============================================================================
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _source_size(source):
+    """Size in bytes of a path, bytes or file-like object (FileStorage included)."""
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    stream = getattr(source, 'stream', source)
+    pos = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(pos)
+    return size
+
+def _open_pdf(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    size = _source_size(source)
+    if size > PDF_MAX_BYTES:
+        raise ValueError(f"PDF is {size // (1024 * 1024)} MB, limit is {PDF_MAX_BYTES // (1024 * 1024)} MB")
+    return pypdf.PdfReader(source)
+
+def iter_pdf_pages(file_storage, max_pages=None):
+    """
+    Yields (page_number, text) one page at a time, skipping empty pages.
+    Accepts a path, bytes or a file-like object (Flask FileStorage).
+    """
+    max_pages = max_pages or PDF_MAX_PAGES
+    reader = _open_pdf(file_storage)
+    total = len(reader.pages)
+    if total > max_pages:
+        print(f"⚠️ PDF has {total} pages, only the first {max_pages} are read")
+    for number in range(1, min(total, max_pages) + 1):
+        content = reader.pages[number - 1].extract_text()
+        if content and content.strip():
+            yield number, content
+
+def _extract_page_range(path, first, last):
+    """Process-pool task: pages first..last (1-based, inclusive) of the PDF at `path`."""
+    reader = pypdf.PdfReader(path)
+    pages = []
+    for number in range(first, last + 1):
+        content = reader.pages[number - 1].extract_text()
+        if content and content.strip():
+            pages.append((number, content))
+    return pages
+
+def _get_pdf_pool(workers=None):
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers or PDF_WORKERS)
+        return _pdf_pool
+
+def extract_pages_parallel(file_storage, max_pages=None, workers=None):
+    """
+    Extracts page ranges in parallel processes; falls back to iter_pdf_pages for
+    short documents, when the pool is disabled, or if a worker process dies.
+    """
+    global _pdf_pool
+    max_pages = max_pages or PDF_MAX_PAGES
+    workers = workers or PDF_WORKERS
+    if isinstance(file_storage, str):
+        source = file_storage
+    elif isinstance(file_storage, (bytes, bytearray)):
+        source = io.BytesIO(file_storage)
+    else:
+        source = getattr(file_storage, 'stream', file_storage)
+        source.seek(0)
+    reader = _open_pdf(source)
+    total = min(len(reader.pages), max_pages)
+    if workers <= 1 or total < PDF_PARALLEL_MIN_PAGES:
+        return list(iter_pdf_pages(source, max_pages))
+    if len(reader.pages) > max_pages:
+        print(f"⚠️ PDF has {len(reader.pages)} pages, only the first {max_pages} are read")
+
+    spooled = None
+    if not isinstance(source, str):
+        # Uploads only exist in this process: copy them to disk once for the workers.
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            source.seek(0)
+            shutil.copyfileobj(source, f)
+            spooled = f.name
+    path = spooled or source
+    step = -(-total // (workers * 2))   # a few ranges per worker evens out slow pages
+    ranges = [(first, min(total, first + step - 1)) for first in range(1, total + 1, step)]
+    try:
+        pool = _get_pdf_pool(workers)
+        futures = [pool.submit(_extract_page_range, path, first, last) for first, last in ranges]
+        return [page for f in futures for page in f.result()]
+    except BrokenProcessPool as e:
+        print(f"⚠️ PDF worker pool failed ({e}), extracting serially")
+        with _pdf_pool_lock:
+            _pdf_pool = None
+        return list(iter_pdf_pages(path, max_pages))
+    finally:
+        if spooled:
+            os.remove(spooled)
+
 def extract_text_from_pdf(file_storage):
     """Extracts text from a Flask FileStorage object (PDF)."""
     try:
-        reader = pypdf.PdfReader(file_storage)
-        text = ""
-        for page in reader.pages:
-            content = page.extract_text()
-            if content:
-                text += content + "\n"
-        return text
+        pages = extract_pages_parallel(file_storage)
+        return "".join(f"{content}\n" for _, content in pages)
+    except Exception as e:
+        print(f"❌ PDF Read Error: {e}")
+        return None
+
+def extract_pages_from_pdf(file_storage):
+    """Like extract_text_from_pdf, but keeps pages apart: [(page_number, text), ...]."""
+    try:
+        return extract_pages_parallel(file_storage)
     except Exception as e:
         print(f"❌ PDF Read Error: {e}")
         return None
 
-def index_document(file_storage, filename, session_id):
-    """Saves a PDF text into the database linked to a Session ID."""
+def chunk_pages(pages, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Splits [(page, text), ...] into overlapping windows of `size` words.
+    Windows may cross page breaks; each records the pages it starts and ends on.
+    """
+    words = [(page, w) for page, text in pages for w in text.split()]
+    step = max(1, size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        window = words[start:start + size]
+        chunks.append({
+            "chunk_index": len(chunks),
+            "page": window[0][0],
+            "page_end": window[-1][0],
+            "text": " ".join(w for _, w in window),
+        })
+        if start + size >= len(words):
+            break
+    return chunks
+
+def _store_chunks(group, material, chunks):
+    """
+    Writes chunks to db.material_chunks, _id = "<group>:<chunk_index>", where the
+    group (stored as material_id) is the content hash of the file, or the material
+    _id for documents stored before hashing.
+    """
+    if not chunks:
+        return
+    try:
+        db.material_chunks.insert_many([{
+            "_id": f"{group}:{c['chunk_index']}",
+            "material_id": group,
+            "title": material.get('title'),
+            "page": c['page'],
+            "page_end": c['page_end'],
+            "chunk_index": c['chunk_index'],
+            "text": c['text'],
+        } for c in chunks], ordered=False)
+    except BulkWriteError:
+        pass  # the same file was chunked concurrently by another upload
+
+# ==============================================================================
+#                       UPLOAD DEDUPLICATION / TEXT CACHE
+# ==============================================================================
+# Uploads are identified by the SHA-256 of their bytes. db.document_texts keeps
+# the extracted pages of every distinct PDF (_id = hash), so a file that was
+# already parsed once (in a chat, for /api/summarize, by another student) is
+# not parsed again. Its chunks and index entries are keyed by the same hash and
+# shared by every session that uploads it.
+
+HASH_BLOCK = 1024 * 1024
+TEXT_CACHE_MAX_CHARS = 8 * 1024 * 1024   # keeps cached pages below MongoDB's 16 MB document limit
+
+def hash_upload(file_storage):
+    """(sha256 hex digest, size in bytes) of a path, bytes or file-like upload; rewinds streams."""
+    digest = hashlib.sha256()
+    if isinstance(file_storage, (bytes, bytearray)):
+        digest.update(file_storage)
+        return digest.hexdigest(), len(file_storage)
+    if isinstance(file_storage, str):
+        with open(file_storage, "rb") as f:
+            return hash_upload(f)
+    stream = getattr(file_storage, 'stream', file_storage)
+    stream.seek(0)
+    size = 0
+    for block in iter(lambda: stream.read(HASH_BLOCK), b""):
+        digest.update(block)
+        size += len(block)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+def get_pdf_pages(file_storage):
+    """
+    (content_hash, [(page_number, text), ...]) for a PDF, served from
+    db.document_texts when the same bytes were parsed before.
+    Pages are None if the file cannot be read.
+    """
+    try:
+        content_hash, size = hash_upload(file_storage)
+    except Exception as e:
+        print(f"❌ PDF Read Error: {e}")
+        return None, None
+
+    pages = get_cached_pages(content_hash)
+    if pages is not None:
+        return content_hash, pages
+
+    t0 = time.perf_counter()
+    pages = extract_pages_from_pdf(file_storage)
+    cache_pages(content_hash, pages, size, (time.perf_counter() - t0) * 1000)
+    return content_hash, pages
+
+def get_cached_pages(content_hash):
+    """Cached [(page, text), ...] of a file hash (counted as a hit), or None."""
+    cached = db.document_texts.find_one_and_update(
+        {"_id": content_hash}, {"$inc": {"hits": 1}, "$set": {"last_hit_at": time.time()}},
+        projection={"pages": 1, "parse_ms": 1, "bytes": 1})
+    if not cached:
+        return None
+    print(f"♻️ Reusing extracted text of {content_hash[:12]} ({cached.get('bytes')} bytes, {cached.get('parse_ms')} ms saved)")
+    return [tuple(p) for p in cached['pages']]
+
+def cache_pages(content_hash, pages, size, parse_ms):
+    if not pages or sum(len(text) for _, text in pages) > TEXT_CACHE_MAX_CHARS:
+        return
+    try:
+        db.document_texts.update_one({"_id": content_hash}, {"$setOnInsert": {
+            "pages": [[number, text] for number, text in pages], "bytes": size, "parse_ms": round(parse_ms, 1),
+            "num_pages": pages[-1][0], "hits": 0, "created_at": time.time()}}, upsert=True)
+    except Exception as e:
+        print(f"⚠️ Could not cache extracted text: {e}")
+
+def extract_text_cached(file_storage):
+    """extract_text_from_pdf through the extracted-text cache."""
+    _, pages = get_pdf_pages(file_storage)
+    if pages is None:
+        return None
+    return "".join(f"{content}\n" for _, content in pages)
+
+def get_dedup_stats():
+    """Bytes and parse time saved by the text cache, and chunk copies avoided by sharing."""
+    texts = next(db.document_texts.aggregate([{"$group": {
+        "_id": None, "documents": {"$sum": 1}, "hits": {"$sum": "$hits"},
+        "bytes_saved": {"$sum": {"$multiply": ["$hits", "$bytes"]}},
+        "parse_ms_saved": {"$sum": {"$multiply": ["$hits", "$parse_ms"]}}}}]), {})
+    shared = next(db.materials.aggregate([
+        {"$match": {"content_hash": {"$exists": True}}},
+        {"$group": {"_id": "$content_hash", "uploads": {"$sum": 1}, "chunks": {"$first": "$num_chunks"}}},
+        {"$group": {"_id": None, "files": {"$sum": 1}, "uploads": {"$sum": "$uploads"},
+                    "chunks_not_copied": {"$sum": {"$multiply": [{"$subtract": ["$uploads", 1]}, "$chunks"]}}}}]), {})
+    course_files = next(db.course_materials.aggregate([
+        {"$match": {"reused_file": True}},
+        {"$group": {"_id": None, "files": {"$sum": 1}, "bytes_saved": {"$sum": "$size"}}}]), {})
+    for d in (texts, shared, course_files):
+        d.pop("_id", None)
+    return {"text_cache": texts, "shared_uploads": shared, "course_files": course_files}
+
+def index_document(file_storage, filename, session_id, progress=None):
+    """
+    Saves a PDF, split into page-tagged chunks, into the database linked to a Session ID.
+    A file that is already stored is only linked to the session, its chunks are shared.
+    The materials entry is written last: until then the document is not searchable.
+    progress(stage, percent) is called between steps (see ingest_queue).
+    """
     print(f"🔍 Indexing: {filename} for Session: {session_id}")
+    progress = progress or (lambda stage, pct: None)
     
-    # We use the function above to get the text
-    text_content = extract_text_from_pdf(file_storage)
+    progress("extracting", 10)
+    content_hash, pages = get_pdf_pages(file_storage)
     
-    if not text_content:
+    if not pages:
         return False
     
     try:
-        db.materials.insert_one({
-            "session_id": session_id,
-            "title": filename,
-            "text_content": text_content,
-            "uploaded_at": time.time(),
-            "type": "User Upload"
-        })
-        print(f"✅ File saved successfully.")
+        material = add_material({"session_id": session_id, "title": filename, "type": "User Upload"},
+                                content_hash, pages, progress)
+        print(f"✅ File saved successfully ({material['num_chunks']} chunks).")
         return True
     except Exception as e:
         print(f"❌ Database Insert Error: {e}")
         return False
 
-def search_database(query, session_id):
-    """Searches for text inside files belonging to this Session."""
-    # Search logic...
-    filter_query = {
-        "$or": [
-            {"uploaded_by": "System"},
-            {"session_id": session_id},
-            {"session_id": "GLOBAL"} # Include Quizzes
-        ]
-    }
-    
+def add_material(material, content_hash, pages, progress=None, persist=True):
+    """
+    Stores a materials entry for already extracted pages and indexes it. Chunks
+    are shared with any earlier material of the same content hash. Scope comes
+    from the entry's session_id ("GLOBAL" for course materials) / uploaded_by.
+    persist=False leaves the index snapshot to the caller (save_search_index).
+    """
+    progress = progress or (lambda stage, pct: None)
+    progress("chunking", 50)
+    material.update({"content_hash": content_hash, "num_pages": pages[-1][0],
+                     "chars": sum(len(text) for _, text in pages)})
+    chunks = None
+    shared = db.material_chunks.count_documents({"material_id": content_hash})
+    if not shared:
+        chunks = chunk_pages(pages)
+        _store_chunks(content_hash, material, chunks)
+    material["num_chunks"] = shared or len(chunks)
+    # Stamped at insert (not at start) so other processes' watermark syncs can't skip it.
+    material["uploaded_at"] = time.time()
+    db.materials.insert_one(material)
+
+    progress("indexing", 80)
+    index = get_search_index()
+    _index_material(index, material, chunks)
+    if persist:
+        _save_index(index)
+    return material
+
+def remove_material(material_id):
+    """
+    Deletes a materials entry. Its chunks and index entries go too unless another
+    material shares them (same content hash); in that case they stay visible from
+    the removed entry's scope until the next rebuild_search_index().
+    """
+    mat = db.materials.find_one_and_delete({"_id": material_id}, projection={"text_content": 0})
+    if not mat:
+        return False
+    group = _material_group(mat)
+    if not db.materials.find_one({"content_hash": group}, {"_id": 1}):
+        db.material_chunks.delete_many({"material_id": group})
+        index = get_search_index()
+        index.remove_group(group)
+        _vectors.remove_group(group)
+        _save_index(index)
+    return True
+
+# ==============================================================================
+#                                SEARCH INDEX
+# ==============================================================================
+
+_index = None
+_vectors = None
+_index_lock = threading.Lock()
+_embedder = {"fn": None, "dim": 256, "name": "hashing-v1"}
+
+def _material_scopes(mat):
+    scopes = set()
+    if mat.get('uploaded_by') == "System":
+        scopes.add(SYSTEM_SCOPE)
+    if mat.get('session_id'):
+        scopes.add(mat['session_id'])
+    return scopes
+
+def _material_group(mat):
+    """Index group / chunk key of a material: its content hash, or its _id if it has none."""
+    return mat.get('content_hash') or str(mat['_id'])
+
+def _index_chunks(index, mat, chunks):
+    group = _material_group(mat)
+    scopes = _material_scopes(mat)
+    items = [(f"{group}:{c['chunk_index']}", c['text']) for c in chunks]
+    for doc_id, text in items:
+        index.add(doc_id, text, group, scopes)
+    # The vector files are shared: another process (or this one before a restart)
+    # may have written this group already, then only its scopes are added.
+    if _vectors.has_group(group):
+        for scope in scopes:
+            _vectors.add_scope(group, scope)
+    else:
+        _vectors.add_many(items, group, scopes)
+
+def _index_material(index, mat, chunks=None):
+    """
+    Indexes a stored material, chunking older whole-text documents on the way.
+    If its chunks are already indexed for another upload, only makes them visible
+    from this material's scopes. Returns True if the index changed.
+    """
+    index.meta["watermark"] = max(index.meta.get("watermark", 0), mat.get('uploaded_at') or 0)
+    group = _material_group(mat)
+    if index.has_group(group):
+        new_scopes = _material_scopes(mat) - index.group_scopes.get(group, set())
+        for scope in new_scopes:
+            index.add_scope(group, scope)
+            _vectors.add_scope(group, scope)
+        return bool(new_scopes)
+    if chunks is None and 'num_chunks' in mat:
+        chunks = list(db.material_chunks.find({"material_id": group}, {"chunk_index": 1, "text": 1}))
+    elif chunks is None:
+        # Stored before chunking existed: split its text_content once and keep the chunks.
+        legacy = db.materials.find_one({"_id": mat['_id']}, {"text_content": 1}) or {}
+        chunks = chunk_pages([(None, legacy.get('text_content', ''))])
+        db.material_chunks.delete_many({"material_id": group})
+        _store_chunks(group, mat, chunks)
+        db.materials.update_one({"_id": mat['_id']}, {"$set": {"num_chunks": len(chunks)}})
+    _index_chunks(index, mat, chunks)
+    return True
+
+def _save_index(index):
     try:
-        # 1. Keyword Search
-        keywords = [w.lower() for w in query.split() if len(w) > 3]
-        if not keywords: return ""
+        index.save(SEARCH_INDEX_PATH)
+    except Exception as e:
+        print(f"⚠️ Could not persist search index: {e}")
+
+def _sync_index(index, full=False):
+    """
+    Brings the index in line with db.materials. A full sync (first load) also
+    drops deleted materials; later syncs only pick up newer uploads.
+    """
+    index.meta["synced_at"] = time.time()
+    if full:
+        mats = list(db.materials.find({}, {"text_content": 0}))
+        groups = {_material_group(m) for m in mats}
+        stale = [g for g in list(index.group_docs) if g not in groups]
+        for group in stale:
+            index.remove_group(group)
+            _vectors.remove_group(group)
+        changed = bool(stale)
+    else:
+        # 5 s of slack for clock skew between app processes
+        mats = db.materials.find({"uploaded_at": {"$gt": index.meta.get("watermark", 0) - 5}}, {"text_content": 0})
+        changed = False
+    for mat in mats:
+        changed = _index_material(index, mat) or changed
+    if changed:
+        _save_index(index)
+
+def _open_vectors():
+    return VectorIndex(INDEX_DIR, embedder=_embedder["fn"], dim=_embedder["dim"], embedder_name=_embedder["name"])
+
+def get_search_index():
+    """The process-wide BM25 index (and its vector twin), loaded from disk and synced on first use."""
+    global _index, _vectors
+    with _index_lock:
+        if _index is None:
+            db.material_chunks.create_index("material_id")
+            db.materials.create_index("content_hash")
+            _vectors = _open_vectors()
+            _index = BM25Index.load(SEARCH_INDEX_PATH)
+            if _index.meta.get("format") != INDEX_FORMAT or (_index.doc_len and not _vectors.ids):
+                # Old snapshot format, or vectors missing/reset: re-index from the stored chunks.
+                # Vector rows still on disk are kept (shared with other processes), only missing ones are added.
+                _index = BM25Index()
+                _index.meta["format"] = INDEX_FORMAT
+            _sync_index(_index, full=True)
+        elif time.time() - _index.meta.get("synced_at", 0) > INDEX_SYNC_INTERVAL:
+            _sync_index(_index)
+        return _index
+
+def save_search_index():
+    _save_index(get_search_index())
 
-        materials = db.materials.find(filter_query)
+def rebuild_search_index():
+    """Re-tokenizes every material from scratch (e.g. after changing the tokenizer)."""
+    global _index, _vectors
+    with _index_lock:
+        _vectors = _open_vectors()
+        _vectors.clear()
+        _index = BM25Index()
+        _index.meta["format"] = INDEX_FORMAT
+        _sync_index(_index, full=True)
+        _save_index(_index)
+        return _index.stats()
+
+def set_embedder(fn, dim, name):
+    """
+    Plugs in another embedding function: fn(list_of_texts) -> float32 array (n, dim).
+    The vector store is rebuilt from the stored chunks on the next search.
+    """
+    global _index
+    with _index_lock:
+        _embedder.update(fn=fn, dim=dim, name=name)
+        _index = None
+
+def _fuse(*rankings):
+    """Reciprocal rank fusion of several [(doc_id, score), ...] rankings."""
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+def _scope_titles(groups, session_id):
+    """
+    Display title of each chunk group as seen from this session: the title of its
+    own materials entry, else the GLOBAL / System one. Chunks are shared between
+    uploads of the same file, so the title stored with them (first uploader's
+    filename) is never shown to another session.
+    """
+    legacy = [ObjectId(g) for g in groups if ObjectId.is_valid(g)]
+    mats = db.materials.find({"$and": [
+        {"$or": [{"content_hash": {"$in": list(groups)}}, {"_id": {"$in": legacy}}]},
+        {"$or": [{"session_id": {"$in": [session_id, "GLOBAL"]}}, {"uploaded_by": "System"}]},
+    ]}, {"title": 1, "content_hash": 1, "session_id": 1})
+    titles = {}
+    for m in sorted(mats, key=lambda m: m.get('session_id') != session_id):   # own upload first
+        titles.setdefault(_material_group(m), m.get('title'))
+    return titles
+
+def search_database(query, session_id, top_k=SEARCH_TOP_PASSAGES):
+    """
+    Searches the files visible from this Session (its uploads, GLOBAL and System docs)
+    and returns the best matching passages, each tagged with its source and page.
+    Keyword (BM25) and semantic (vector) matches are merged, so paraphrased
+    questions still find their passage.
+    """
+    try:
+        scopes = {session_id, "GLOBAL", SYSTEM_SCOPE}
+        lexical = get_search_index().search(query, scopes, k=HYBRID_CANDIDATES)
+        semantic = _vectors.search(query, scopes, k=HYBRID_CANDIDATES)
+        hits = _fuse(lexical, semantic)[:top_k]
+        if not hits: return ""
+
+        found = {c['_id']: c for c in db.material_chunks.find({"_id": {"$in": [doc_id for doc_id, _ in hits]}},
+                                                              {"material_id": 1, "page": 1, "page_end": 1, "text": 1})}
+        titles = _scope_titles({c['material_id'] for c in found.values()}, session_id)
         results = []
-        
-        for mat in materials:
-            score = 0
-            content = mat.get('text_content', '').lower()
-            for k in keywords:
-                if k in content: score += 1
-            
-            if score > 0:
-                snippet = mat['text_content'][:1000]
-                results.append(f"SOURCE ({mat.get('title')}): {snippet}...")
-        
-        if not results: return ""
-        return "\n\n".join(results[:2])
+        for doc_id, _ in hits:
+            chunk = found.get(doc_id)
+            if chunk:
+                pages = ""
+                if chunk.get('page'):
+                    pages = f", p. {chunk['page']}" if chunk.get('page_end') in (None, chunk['page']) \
+                        else f", p. {chunk['page']}-{chunk['page_end']}"
+                results.append(f"SOURCE ({titles.get(chunk['material_id']) or 'Document'}{pages}): {chunk['text']}")
+
+        return "\n\n".join(results)
 
     except Exception as e:
         print(f"❌ Search Error: {e}")
-        return ""
\ No newline at end of file
+        return ""
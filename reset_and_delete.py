@@ -26,7 +26,11 @@ db.marks.delete_many({})
 db.presence.delete_many({})
 db.document_requests.delete_many({})
 db.conversations.delete_many({}) # Optional: Remove student chats
+db.messages.delete_many({})
 db.quizzes.delete_many({})
+db.quiz_attempts.delete_many({})
+db.quiz_stats.delete_many({})
+db.quiz_class_stats.delete_many({})
 
 print("✅ Cleanup Complete. (Staff and Subjects were NOT touched)")
 
@@ -0,0 +1,204 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import llm_client
+
+# ==============================================================================
+#                    RESPONSE CACHE FOR DETERMINISTIC AI ENDPOINTS
+# ==============================================================================
+# Summaries, study plans and quizzes are cached by a hash of
+# (feature, normalized input, options, model). Lookups go to an in-process LRU
+# first, then (if AI_CACHE_PERSIST=1) to MongoDB, whose TTL index expires old
+# entries. Only successful results are stored; fallback/error text never is.
+#
+# Environment:
+#   AI_CACHE_SIZE        max entries in the in-process tier
+#   AI_CACHE_TTL         seconds an entry stays valid (both tiers)
+#   AI_CACHE_PERSIST     1 to enable the MongoDB tier (collection ai_response_cache)
+#   AI_CACHE_DISABLED    comma separated features to bypass, e.g. "quiz,planner"
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(base_dir, ".env"))
+
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "512"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))
+AI_CACHE_PERSIST = os.getenv("AI_CACHE_PERSIST", "0") == "1"
+AI_CACHE_DISABLED = {f.strip() for f in os.getenv("AI_CACHE_DISABLED", "").split(",") if f.strip()}
+
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU with a size bound and per-entry TTL."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return MISSING if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._data), "max_size": self.max_entries, "ttl_seconds": self.ttl,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+_memory = LRUCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+_stats_lock = threading.Lock()
+_feature_stats = {}   # feature -> {"memory_hits", "db_hits", "misses", "bypassed"}
+_collection = None
+
+def _count(feature, field):
+    with _stats_lock:
+        s = _feature_stats.setdefault(feature, {"memory_hits": 0, "db_hits": 0, "misses": 0, "bypassed": 0})
+        s[field] += 1
+
+def _persistent():
+    """Lazily connects the MongoDB tier and makes sure its TTL index exists."""
+    global _collection
+    if not AI_CACHE_PERSIST:
+        return None
+    if _collection is None:
+        from pymongo import MongoClient
+        coll = MongoClient(os.getenv("MONGO_URI"))["chatbot_ai_app"]["ai_response_cache"]
+        coll.create_index("created_at", expireAfterSeconds=AI_CACHE_TTL)
+        _collection = coll
+    return _collection
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def cache_key(feature, payload, options=None):
+    raw = json.dumps({
+        "feature": feature,
+        "input": _normalize(payload),
+        "options": _normalize(options or {}),
+        "model": llm_client.get_settings(feature)["model"],
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def is_enabled(feature):
+    return feature not in AI_CACHE_DISABLED
+
+def _copy(value):
+    return value if isinstance(value, str) else copy.deepcopy(value)
+
+def lookup(feature, key):
+    """Memory tier, then MongoDB tier (promoting hits). Returns MISSING on a miss."""
+    value = _memory.get(key)
+    if value is not MISSING:
+        _count(feature, "memory_hits")
+        return _copy(value)
+    try:
+        coll = _persistent()
+        if coll is not None:
+            doc = coll.find_one({"_id": key})
+            created = doc and doc["created_at"].replace(tzinfo=timezone.utc).timestamp()
+            if doc and time.time() - created < AI_CACHE_TTL:
+                _memory.set(key, doc["value"])
+                _count(feature, "db_hits")
+                return _copy(doc["value"])
+    except Exception as e:
+        print(f"⚠️ AI cache read error: {e}")
+    _count(feature, "misses")
+    return MISSING
+
+def store(feature, key, value):
+    _memory.set(key, _copy(value))
+    try:
+        coll = _persistent()
+        if coll is not None:
+            coll.replace_one({"_id": key}, {"_id": key, "feature": feature, "value": value,
+                                            "created_at": datetime.now(timezone.utc)}, upsert=True)
+    except Exception as e:
+        print(f"⚠️ AI cache write error: {e}")
+
+def get_or_compute(feature, payload, compute, options=None):
+    """
+    Returns the cached result for (feature, payload, options) or calls compute()
+    and caches what it returns. Exceptions from compute() propagate uncached.
+    """
+    if not is_enabled(feature):
+        _count(feature, "bypassed")
+        return compute()
+    key = cache_key(feature, payload, options)
+    value = lookup(feature, key)
+    if value is not MISSING:
+        return value
+    value = compute()
+    store(feature, key, value)
+    return _copy(value)
+
+def stream_or_compute(feature, payload, stream, options=None):
+    """
+    Streaming get_or_compute: yields a cached result in one piece, otherwise the
+    chunks of stream() as they arrive, and caches their concatenation once the
+    stream completes. Abandoned or failed streams are not cached.
+    """
+    if not is_enabled(feature):
+        _count(feature, "bypassed")
+        yield from stream()
+        return
+    key = cache_key(feature, payload, options)
+    value = lookup(feature, key)
+    if value is not MISSING:
+        yield value
+        return
+    parts = []
+    for chunk in stream():
+        parts.append(chunk)
+        yield chunk
+    store(feature, key, "".join(parts))
+
+def get_cache_stats():
+    with _stats_lock:
+        features = {}
+        for f, s in _feature_stats.items():
+            lookups = s["memory_hits"] + s["db_hits"] + s["misses"]
+            features[f] = dict(s, hit_rate=round((s["memory_hits"] + s["db_hits"]) / lookups, 3) if lookups else 0.0)
+    return {"memory": _memory.stats(), "persistent": AI_CACHE_PERSIST,
+            "disabled": sorted(AI_CACHE_DISABLED), "features": features}
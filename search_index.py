@@ -0,0 +1,152 @@
+import os
+import re
+import math
+import pickle
+import threading
+import unicodedata
+
+# ==============================================================================
+#                          BM25 INVERTED INDEX (LEXICAL SEARCH)
+# ==============================================================================
+# Postings map each term to the documents containing it, so a query only looks
+# at documents sharing at least one term with it instead of scanning the corpus.
+# Documents belong to a group (the material they come from); a group is visible
+# from one or more scopes (a chat session id, "GLOBAL", SYSTEM_SCOPE).
+#
+# The index knows nothing about MongoDB: rag_utils feeds it and persists it.
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+SYSTEM_SCOPE = "__system__"
+
+_STOPWORDS = {
+    # English
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "was", "our", "out",
+    "has", "have", "had", "this", "that", "with", "from", "they", "will", "would", "there",
+    "their", "what", "which", "when", "where", "who", "how", "about", "into", "than", "then",
+    "them", "these", "those", "been", "being", "does", "did", "its", "also", "just", "more",
+    # French
+    "les", "des", "une", "est", "que", "qui", "dans", "pour", "par", "sur", "pas", "plus", "avec",
+    "son", "ses", "aux", "cette", "ces", "sont", "ont", "mais", "comme", "tout", "tous", "elle",
+    "nous", "vous", "leur", "leurs", "entre", "donc", "quoi", "quel", "quelle", "quels", "comment",
+}
+
+def tokenize(text):
+    """Lowercase, accent-folded word tokens without stopwords and 1-char noise."""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"[a-z0-9]+", text) if len(t) > 1 and t not in _STOPWORDS]
+
+
+class BM25Index:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.postings = {}     # term -> {doc_id: term frequency}
+        self.doc_len = {}      # doc_id -> number of tokens
+        self.doc_terms = {}    # doc_id -> distinct terms (for removal)
+        self.doc_group = {}    # doc_id -> group
+        self.group_docs = {}   # group -> set of doc_id
+        self.group_scopes = {} # group -> set of scopes allowed to see it
+        self.total_len = 0
+        self.meta = {}         # free-form bookkeeping for the owner (sync watermarks, ...)
+
+    # --- updates -------------------------------------------------------------
+
+    def add(self, doc_id, text, group, scopes):
+        tokens = tokenize(text)
+        counts = {}
+        for t in tokens:
+            counts[t] = counts.get(t, 0) + 1
+        with self._lock:
+            self._remove_doc(doc_id)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.doc_len[doc_id] = len(tokens)
+            self.doc_terms[doc_id] = tuple(counts)
+            self.doc_group[doc_id] = group
+            self.group_docs.setdefault(group, set()).add(doc_id)
+            self.group_scopes.setdefault(group, set()).update(scopes)
+            self.total_len += len(tokens)
+
+    def add_scope(self, group, scope):
+        with self._lock:
+            if group in self.group_docs:
+                self.group_scopes.setdefault(group, set()).add(scope)
+                return True
+            return False
+
+    def _remove_doc(self, doc_id):
+        if doc_id not in self.doc_len:
+            return
+        for term in self.doc_terms.pop(doc_id):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id)
+        group = self.doc_group.pop(doc_id)
+        self.group_docs.get(group, set()).discard(doc_id)
+
+    def remove_group(self, group):
+        with self._lock:
+            for doc_id in list(self.group_docs.pop(group, ())):
+                self._remove_doc(doc_id)
+            self.group_scopes.pop(group, None)
+
+    def has_group(self, group):
+        return group in self.group_docs
+
+    # --- queries -------------------------------------------------------------
+
+    def search(self, query, scopes, k=5):
+        """Top-k (doc_id, score) visible from any of `scopes`, best first."""
+        terms = set(tokenize(query))
+        scopes = set(scopes)
+        with self._lock:
+            n = len(self.doc_len)
+            if not n or not terms:
+                return []
+            avgdl = self.total_len / n or 1.0
+            scores = {}
+            visible = {}
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    ok = visible.get(doc_id)
+                    if ok is None:
+                        ok = visible[doc_id] = not scopes.isdisjoint(self.group_scopes.get(self.doc_group[doc_id], ()))
+                    if not ok:
+                        continue
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_id] / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self.doc_len), "groups": len(self.group_docs),
+                    "terms": len(self.postings), "avg_doc_len": round(self.total_len / len(self.doc_len), 1) if self.doc_len else 0}
+
+    # --- persistence ---------------------------------------------------------
+
+    def save(self, path):
+        """Atomic snapshot (write to a temp file, then rename)."""
+        with self._lock:
+            state = {k: v for k, v in self.__dict__.items() if k != "_lock"}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"   # one temp file per process: concurrent saves can't interleave
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                index.__dict__.update(pickle.load(f))
+        return index
@@ -1,50 +1,124 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import time
+from concurrent.futures import ThreadPoolExecutor
+import llm_client
+import response_cache
 
-load_dotenv()
+# Long documents are summarized map-reduce style: the text is cut into chunks,
+# each chunk is turned into study notes (map, SUMMARY_MAP_WORKERS at a time),
+# and the notes are summarized in the requested style (reduce). Notes are cached
+# per chunk content, independent of summary_type, so asking for another format
+# of the same document only runs the reduce pass. Text up to
+# SUMMARY_DIRECT_MAX_CHARS is summarized in a single call as before.
+SUMMARY_DIRECT_MAX_CHARS = int(os.getenv("SUMMARY_DIRECT_MAX_CHARS", "12000"))
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "8000"))
+SUMMARY_MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS", "4"))
 
-api_key = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=api_key)
+_map_pool = ThreadPoolExecutor(max_workers=SUMMARY_MAP_WORKERS, thread_name_prefix="summary-map")
 
-# Use the working model
-model = genai.GenerativeModel('gemma-3-1b-it') 
-
-def summarize_content(text, summary_type="bullet_points"):
-    """
-    Summarizes text based on the requested style.
-    summary_type options: 'bullet_points', 'paragraph', 'concise'
-    """
-    
-    # Custom instructions based on type
-    style_instruction = ""
+def _style_instruction(summary_type):
     if summary_type == "bullet_points":
-        style_instruction = "Format: A structured list of bullet points with bold headers for key topics."
+        return "Format: A structured list of bullet points with bold headers for key topics."
     elif summary_type == "concise":
-        style_instruction = "Format: A very short, high-level executive summary (max 3-4 sentences)."
+        return "Format: A very short, high-level executive summary (max 3-4 sentences)."
     else:
-        style_instruction = "Format: A coherent, well-written paragraph explaining the content."
+        return "Format: A coherent, well-written paragraph explaining the content."
 
-    prompt = f"""
+def _summary_prompt(content, summary_type, from_notes=False):
+    source = "NOTES COVERING THE WHOLE DOCUMENT, IN ORDER" if from_notes else "CONTENT TO SUMMARIZE"
+    return f"""
     You are an expert University Note-Taker.
-    
+
     TASK:
     Summarize the following content for a student who needs to study for an exam.
-    {style_instruction}
-    
+    {_style_instruction(summary_type)}
+
     RULES:
     1. Ignore irrelevant text (like page numbers, headers).
     2. Focus on Definitions, Dates, and Core Concepts.
     3. Use **bold** for important terms.
     4. Keep it clear and readable.
-    
-    CONTENT TO SUMMARIZE:
-    {text}
+
+    {source}:
+    {content}
+    """
+
+def split_text(text, size=SUMMARY_CHUNK_CHARS):
+    """Cuts text into pieces of at most `size` chars, preferring paragraph, then line, then sentence, then word breaks."""
+    chunks = []
+    while len(text) > size:
+        window = text[:size]
+        cut = size
+        for sep in ("\n\n", "\n", ". ", " "):
+            found = window.rfind(sep)
+            if found > size // 2:
+                cut = found + len(sep)
+                break
+        chunks.append(text[:cut])
+        text = text[cut:]
+    if text.strip():
+        chunks.append(text)
+    return chunks
+
+def _chunk_notes(chunk):
+    """Map step: dense notes of one chunk, cached by its content."""
+    prompt = f"""
+    You are an expert University Note-Taker.
+    Write dense study notes of this excerpt of a longer course document:
+    definitions, dates, formulas, core concepts and examples, as short bullet points.
+    Do not add an introduction or a conclusion. Use **bold** for important terms.
+
+    EXCERPT:
+    {chunk}
+    """
+    return response_cache.get_or_compute("summary_map", chunk, lambda: llm_client.generate("summary_map", prompt))
+
+def _map_notes(text):
+    """Notes for the whole text, collapsed again while they are still too long for one reduce call."""
+    level = 0
+    while len(text) > SUMMARY_DIRECT_MAX_CHARS:
+        chunks = split_text(text)
+        started = time.time()
+        notes = list(_map_pool.map(_chunk_notes, chunks))
+        print(f"🧩 Summary map (level {level}): {len(chunks)} chunks in {time.time() - started:.1f}s "
+              f"({SUMMARY_MAP_WORKERS} in parallel)")
+        merged = "\n\n".join(notes)
+        if len(merged) >= len(text):
+            return merged   # notes no shorter than their input: reduce what we have
+        text = merged
+        level += 1
+    return text
+
+def summarize_content(text, summary_type="bullet_points"):
+    """
+    Summarizes text based on the requested style.
+    summary_type options: 'bullet_points', 'paragraph', 'concise'
     """
-    
+    def compute():
+        if len(text) <= SUMMARY_DIRECT_MAX_CHARS:
+            return llm_client.generate("summary", _summary_prompt(text, summary_type))
+        notes = _map_notes(text)
+        return llm_client.generate("summary", _summary_prompt(notes, summary_type, from_notes=True))
+
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        return response_cache.get_or_compute("summary", text, compute, options={"summary_type": summary_type})
+    except llm_client.LLMBusyError:
+        raise
     except Exception as e:
         print(f"❌ Summary Error: {e}")
-        return "Désolé, je n'ai pas pu résumer ce contenu. (Erreur AI)"
\ No newline at end of file
+        return "Désolé, je n'ai pas pu résumer ce contenu. (Erreur AI)"
+
+def stream_summary(text, summary_type="bullet_points"):
+    """
+    Same as summarize_content, but yields the summary chunk by chunk. For long
+    documents the map stage runs first; only the final pass is streamed.
+    Errors propagate to the caller (the SSE route reports them).
+    """
+    def stream():
+        if len(text) <= SUMMARY_DIRECT_MAX_CHARS:
+            yield from llm_client.generate_stream("summary", _summary_prompt(text, summary_type))
+        else:
+            notes = _map_notes(text)
+            yield from llm_client.generate_stream("summary", _summary_prompt(notes, summary_type, from_notes=True))
+
+    yield from response_cache.stream_or_compute("summary", text, stream, options={"summary_type": summary_type})
@@ -0,0 +1,89 @@
+import json
+import unittest
+from unittest import mock
+
+import llm_client
+import quiz_core
+import response_cache
+from response_cache import LRUCache
+
+
+def _question(i, text=None):
+    return {"id": str(i), "question": text or f"Question {i} ?", "options": ["A", "B", "C", "D"],
+            "correct_answer": "A", "hint": "h", "explanation": "e"}
+
+def _quiz_json(texts=None):
+    texts = texts or {}
+    return json.dumps({"subject": "Réseaux", "questions": [_question(i, texts.get(i)) for i in range(1, 6)]},
+                      ensure_ascii=False, indent=2)
+
+# Model output with an unescaped quote inside question 2.
+STRAY_QUOTE = _quiz_json().replace('"Question 2 ?"', '"Qu\'est-ce qu\'un "pare-feu ?"')
+# Model output with an unbalanced quote in the prose before the JSON.
+PROSE_QUOTE = 'Voici le quiz "demandé :\n' + _quiz_json()
+
+
+def _parse(text, step=None):
+    parser = quiz_core.QuizStreamParser()
+    step = step or len(text)
+    found = []
+    for i in range(0, len(text), step):
+        found += parser.feed(text[i:i + step])
+    found += parser.finish()
+    return [q["question"] for q in found], parser.skipped
+
+
+class QuizStreamParserTest(unittest.TestCase):
+
+    def test_stray_quote_in_a_question_only_loses_that_question(self):
+        for step in (None, 7, 1):
+            questions, skipped = _parse(STRAY_QUOTE, step)
+            self.assertEqual(questions, ["Question 1 ?", "Question 3 ?", "Question 4 ?", "Question 5 ?"])
+            self.assertEqual(skipped, 1)
+
+    def test_quote_in_prose_before_the_json_is_ignored(self):
+        for step in (None, 7, 1):
+            questions, skipped = _parse(PROSE_QUOTE, step)
+            self.assertEqual(len(questions), 5)
+            self.assertEqual(skipped, 0)
+
+    def test_cut_off_question_is_counted_as_skipped(self):
+        questions, skipped = _parse(_quiz_json()[:-60])
+        self.assertEqual(len(questions), 4)
+        self.assertEqual(skipped, 1)
+
+
+class QuizCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output = _quiz_json()
+        patches = [
+            mock.patch.object(llm_client, "_backend_name", "stub"),
+            mock.patch.dict(llm_client._backends["stub"].responders, {"quiz": lambda prompt: self.output}),
+            mock.patch.object(response_cache, "_memory", LRUCache(100, 3600)),
+            mock.patch.object(response_cache, "AI_CACHE_PERSIST", False),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_complete_quiz_is_cached(self):
+        quiz_core.generate_quiz_ai("Réseaux", "Moyen", "French")
+        self.output = STRAY_QUOTE
+        self.assertEqual(len(quiz_core.generate_quiz_ai("Réseaux", "Moyen", "French")["questions"]), 5)
+
+    def test_quiz_with_dropped_questions_is_not_cached(self):
+        self.output = STRAY_QUOTE
+        self.assertEqual(len(quiz_core.generate_quiz_ai("Réseaux", "Moyen", "French")["questions"]), 4)
+        self.output = _quiz_json()
+        self.assertEqual(len(quiz_core.generate_quiz_ai("Réseaux", "Moyen", "French")["questions"]), 5)
+
+    def test_streamed_quiz_with_dropped_questions_is_not_cached(self):
+        self.output = STRAY_QUOTE
+        self.assertEqual(len(list(quiz_core.stream_quiz_questions("Réseaux", "Moyen", "French"))), 4)
+        self.output = _quiz_json()
+        self.assertEqual(len(list(quiz_core.stream_quiz_questions("Réseaux", "Moyen", "French"))), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from unittest import mock
+
+import quiz_pool
+
+
+class TakeQuizRefillTest(unittest.TestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(quiz_pool, "db", create=True),   # the module-level client may not have connected
+            mock.patch.object(quiz_pool, "schedule_refill"),
+            mock.patch.object(quiz_pool, "ensure_indexes"),
+            mock.patch.object(quiz_pool, "QUIZ_POOL_TARGET", 3),
+            mock.patch.object(quiz_pool, "QUIZ_POOL_MIN_REQUESTS", 3),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.db = quiz_pool.db
+        self.refill = quiz_pool.schedule_refill
+
+    def take(self, pooled, requests):
+        self.db.quiz_pool.find_one_and_delete.return_value = pooled
+        self.db.quiz_pool_keys.find_one_and_update.return_value = {"_id": "k", "requests": requests}
+        return quiz_pool.take_quiz("Cloud", "Moyen", "French")
+
+    def test_single_miss_does_not_fill_pool(self):
+        self.assertIsNone(self.take(None, requests=1))
+        self.refill.assert_not_called()
+
+    def test_popular_key_is_refilled_after_a_miss(self):
+        self.take(None, requests=3)
+        self.refill.assert_called_once_with("Cloud", "Moyen", "French")
+
+    def test_hit_keeps_pooled_key_topped_up(self):
+        content = {"subject": "Cloud", "questions": []}
+        self.assertEqual(self.take({"content": content}, requests=1), content)
+        self.refill.assert_called_once_with("Cloud", "Moyen", "French")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import unittest
+from unittest import mock
+
+from langchain_core.messages import HumanMessage
+
+import llm_client
+import response_cache
+from response_cache import LRUCache
+
+with mock.patch("pymongo.MongoClient"):   # app.py pings MongoDB at import
+    import app
+
+import chatbot_core
+
+
+def sse_frames(resp):
+    """[(event, data), ...] of an SSE response; token frames have event None."""
+    frames = []
+    for block in resp.get_data(as_text=True).split("\n\n"):
+        if not block.strip():
+            continue
+        event = None
+        data = None
+        for line in block.split("\n"):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        frames.append((event, data))
+    return frames
+
+def busy_stream(*args, **kwargs):
+    raise llm_client.LLMBusyError("test", 429, "queue full", retry_after=7)
+    yield   # generator, like llm_client's streams
+
+
+class SSERouteTest(unittest.TestCase):
+    """Routes driven through the Flask test client with the stub LLM backend and an in-memory AI cache."""
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(llm_client, "_backend_name", "stub"),
+            mock.patch.object(response_cache, "_memory", LRUCache(100, 3600)),
+            mock.patch.object(response_cache, "AI_CACHE_PERSIST", False),
+            mock.patch.object(app, "db"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.client = app.app.test_client()
+
+
+class ChatStreamTest(SSERouteTest):
+
+    def setUp(self):
+        super().setUp()
+        for p in [
+            mock.patch.object(chatbot_core, "build_chat_messages",
+                              lambda message, session_id, timings=None: [HumanMessage(content=message)]),
+            mock.patch.object(app, "save_chat_turn", return_value="New Chat"),
+        ]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def chat(self):
+        return sse_frames(self.client.post("/api/chat/stream", json={"session_id": "s1", "message": "Bonjour le cloud"}))
+
+    def test_tokens_then_done_with_the_full_response(self):
+        frames = self.chat()
+        self.assertEqual([e for e, _ in frames[:-1]], [None] * (len(frames) - 1))
+        self.assertGreater(len(frames), 2)
+        event, done = frames[-1]
+        self.assertEqual(event, "done")
+        self.assertEqual(done["response"], "".join(d["token"] for _, d in frames[:-1]))
+        self.assertEqual(done["title"], "New Chat")
+        app.save_chat_turn.assert_called_once_with("s1", None, "Bonjour le cloud", done["response"])
+
+    def test_busy_llm_ends_with_an_error_frame(self):
+        with mock.patch.object(llm_client, "stream_chat", busy_stream):
+            frames = self.chat()
+        self.assertEqual(frames, [("error", {"error": "AI Busy", "retry_after": 7})])
+        app.save_chat_turn.assert_not_called()
+
+    def test_missing_session_is_rejected(self):
+        resp = self.client.post("/api/chat/stream", json={"message": "Bonjour"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class TextStreamTest(SSERouteTest):
+
+    def summarize(self, text):
+        return self.client.post("/api/summarize/stream", data={"text": text, "type": "bullet_points"})
+
+    def test_summary_tokens_then_done(self):
+        frames = sse_frames(self.summarize("Le cloud computing fournit des ressources à la demande."))
+        self.assertEqual(frames[-1][0], "done")
+        self.assertTrue(frames[-1][1]["success"])
+        self.assertEqual(frames[-1][1]["summary"], "".join(d["token"] for e, d in frames[:-1]))
+        self.assertTrue(all(e is None for e, _ in frames[:-1]))
+
+    def test_summary_busy_llm_ends_with_an_error_frame(self):
+        with mock.patch.object(llm_client, "generate_stream", busy_stream):
+            frames = sse_frames(self.summarize("Texte à résumer."))
+        self.assertEqual(frames, [("error", {"error": "AI Busy", "retry_after": 7})])
+
+    def test_empty_text_is_rejected(self):
+        self.assertEqual(self.summarize("").status_code, 400)
+        self.assertEqual(self.client.post("/api/summarize", data={"text": ""}).status_code, 400)
+
+    def test_plan_comes_before_done(self):
+        app.db.materials.find.return_value = [{"title": "Cloud_chap1.pdf"}, {"title": None}]
+        frames = sse_frames(self.client.post("/api/plan/generate/stream",
+                                             json={"days": 2, "subjects": ["Cloud"], "goal": "Examen"}))
+        self.assertEqual(frames[-1][0], "done")
+        plan = frames[-1][1]["plan"]
+        self.assertTrue(plan.startswith("## Plan de révision sur 2 jours"))
+        self.assertIn("Cloud_chap1.pdf", plan)
+
+
+class QuizStreamTest(SSERouteTest):
+
+    def setUp(self):
+        super().setUp()
+        import quiz_pool
+        import quiz_store
+        for p in [
+            mock.patch.object(quiz_pool, "take_quiz", return_value=None),
+            mock.patch.object(quiz_store, "ensure_indexes"),
+        ]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def generate(self):
+        return sse_frames(self.client.post("/api/quiz/generate",
+                                           json={"stream": True, "subject": "Cloud", "difficulty": "Moyen",
+                                                 "language": "French"}))
+
+    def test_start_questions_done(self):
+        frames = self.generate()
+        self.assertEqual([e for e, _ in frames], ["start"] + ["question"] * 5 + ["done"])
+        quiz_id = frames[0][1]["quiz_id"]
+        self.assertEqual(frames[-1][1], {"success": True, "quiz_id": quiz_id, "total": 5})
+        self.assertEqual([d["index"] for _, d in frames[1:-1]], list(range(5)))
+        self.assertTrue(all("correct_answer" not in d["question"] for _, d in frames[1:-1]))
+        pushes = [c for c in app.db.quizzes.update_one.call_args_list if "$push" in c.args[1]]
+        self.assertEqual(len(pushes), 5)   # each question is stored before it is sent
+
+    def test_busy_llm_ends_with_an_error_frame_and_no_quiz(self):
+        with mock.patch.object(llm_client, "generate_stream", busy_stream):
+            frames = self.generate()
+        self.assertEqual([e for e, _ in frames], ["start", "error"])
+        self.assertEqual(frames[1][1], {"error": "AI Busy", "retry_after": 7})
+        app.db.quizzes.delete_one.assert_called_once_with({"quiz_id": frames[0][1]["quiz_id"], "status": "generating"})
+
+
+if __name__ == "__main__":
+    unittest.main()
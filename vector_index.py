@@ -0,0 +1,277 @@
+import os
+import json
+import zlib
+import math
+import threading
+from contextlib import contextmanager
+import numpy as np
+from search_index import tokenize
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ==============================================================================
+#                     LOCAL VECTOR INDEX (DENSE / SEMANTIC RETRIEVAL)
+# ==============================================================================
+# Offline dense retrieval next to the BM25 index. Chunks are embedded by a
+# local function (default: hashed word + character-trigram features, so
+# "réseaux"/"réseau" or "learn"/"learning" still overlap) and stored as rows of
+# one contiguous float32 matrix on disk, memory-mapped for search. New chunks
+# are appended to the file; deleted ones are masked out until the next rebuild.
+#
+# Any other embedder can be plugged in with rag_utils.set_embedder(fn, dim, name) where
+# fn(list_of_texts) -> float32 array of shape (len(texts), dim).
+#
+# Several processes (app workers, course_indexer) share the files. Every change
+# is made under an exclusive lock on <name>.lock: the writer reloads the
+# metadata, takes the next row number from the matrix file itself, appends and
+# replaces the metadata before releasing the lock. Readers pick up other
+# processes' changes when the metadata file changes. A doc_id that already has
+# a live row is not appended again. (Without fcntl, e.g. on Windows, the lock
+# only covers threads of one process.)
+
+DEFAULT_DIM = 256
+SEARCH_BLOCK_ROWS = 65536   # rows multiplied per step, bounds temporary memory
+
+def _bucket(feature, dim):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, (1.0 if (h >> 31) & 1 else -1.0)
+
+def hashing_embedder(texts, dim=DEFAULT_DIM):
+    """Signed feature hashing of words (weight 1) and char trigrams (weight 0.5), log tf, L2-normalized."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = {}
+        for token in tokenize(text):
+            counts["w:" + token] = counts.get("w:" + token, 0) + 1.0
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                gram = "c:" + padded[i:i + 3]
+                counts[gram] = counts.get(gram, 0) + 0.5
+        for feature, tf in counts.items():
+            col, sign = _bucket(feature, dim)
+            out[row, col] += sign * (1.0 + math.log(tf)) if tf >= 1 else sign * tf
+        norm = np.linalg.norm(out[row])
+        if norm:
+            out[row] /= norm
+    return out
+
+
+class VectorIndex:
+
+    def __init__(self, directory, name="vectors", embedder=None, dim=DEFAULT_DIM, embedder_name="hashing-v1"):
+        self.matrix_path = os.path.join(directory, f"{name}.f32")
+        self.meta_path = os.path.join(directory, f"{name}.json")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self._lock = threading.RLock()
+        self.embedder = embedder or (lambda texts: hashing_embedder(texts, dim))
+        self.dim = dim
+        self.embedder_name = embedder_name
+        self._row_bytes = 4 * dim
+        self._meta_stamp = None
+        self._meta_ok = True
+        self._reset()
+        self._load_meta()
+
+    # --- storage -------------------------------------------------------------
+
+    def _reset(self):
+        """Empty in-memory state (the files are left alone)."""
+        self.ids = []              # row -> doc_id
+        self.row_of = {}           # doc_id -> row
+        self.groups = []           # group number -> group
+        self.group_number = {}     # group -> group number
+        self.group_scopes = {}     # group -> set of scopes
+        self.row_group = np.zeros(0, dtype=np.int32)
+        self.deleted = set()       # rows masked out
+        self._matrix = None
+
+    def _load_meta(self):
+        """
+        Reloads the metadata if another writer replaced it since the last read.
+        Returns False if what is on disk is unusable (other embedder, rows missing):
+        the state is then empty and the next write starts the files over.
+        """
+        with self._lock:
+            try:
+                st = os.stat(self.meta_path)
+                stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+            except FileNotFoundError:
+                stamp = None
+            if stamp is not None and stamp == self._meta_stamp:
+                return self._meta_ok
+            self._meta_stamp = stamp
+            self._reset()
+            if stamp is None:
+                self._meta_ok = not os.path.exists(self.matrix_path)
+                return self._meta_ok
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            rows_on_disk = os.path.getsize(self.matrix_path) // self._row_bytes if os.path.exists(self.matrix_path) else 0
+            self._meta_ok = meta.get("dim") == self.dim and meta.get("embedder") == self.embedder_name \
+                and len(meta.get("ids", [])) <= rows_on_disk
+            if not self._meta_ok:
+                return False
+            self.ids = meta["ids"]
+            self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            self.groups = meta["groups"]
+            self.group_number = {g: i for i, g in enumerate(self.groups)}
+            self.group_scopes = {g: set(s) for g, s in meta["group_scopes"].items()}
+            self.row_group = np.asarray(meta["row_group"], dtype=np.int32)
+            self.deleted = set(meta["deleted"])
+            for row in self.deleted:
+                if self.row_of.get(self.ids[row]) == row:
+                    del self.row_of[self.ids[row]]
+            return True
+
+    def _save_meta(self):
+        tmp = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "embedder": self.embedder_name, "ids": self.ids, "groups": self.groups,
+                       "group_scopes": {g: sorted(s) for g, s in self.group_scopes.items()},
+                       "row_group": self.row_group.tolist(), "deleted": sorted(self.deleted)}, f)
+        os.replace(tmp, self.meta_path)
+        st = os.stat(self.meta_path)
+        self._meta_stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        self._meta_ok = True
+
+    @contextmanager
+    def _writing(self):
+        """Thread + file lock for a change, with the latest metadata loaded."""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.matrix_path), exist_ok=True)
+            with open(self.lock_path, "a") as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    if not self._load_meta():
+                        self._wipe()
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _wipe(self):
+        self._reset()
+        if os.path.exists(self.matrix_path):
+            os.remove(self.matrix_path)
+        self._save_meta()
+
+    def _mapped(self):
+        """Read-only memory map of the whole matrix, reopened after appends."""
+        if self._matrix is None and self.ids:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+        return self._matrix
+
+    # --- updates -------------------------------------------------------------
+
+    def has_group(self, group):
+        """True if the group has live rows (written by any process)."""
+        with self._lock:
+            self._load_meta()
+            return group in self.group_scopes
+
+    def add_many(self, items, group, scopes):
+        """
+        Appends [(doc_id, text), ...] of one group and makes the group visible
+        from scopes. doc_ids that already have a live row are skipped, so a group
+        indexed by another process is not appended twice.
+        """
+        if not items:
+            return
+        with self._lock:
+            self._load_meta()
+            missing = [(doc_id, text) for doc_id, text in items if doc_id not in self.row_of]
+        vectors = np.ascontiguousarray(self.embedder([text for _, text in missing]), dtype=np.float32) \
+            if missing else np.zeros((0, self.dim), dtype=np.float32)
+
+        with self._writing():
+            keep = [i for i, (doc_id, _) in enumerate(missing) if doc_id not in self.row_of]   # re-check under the lock
+            if not keep and set(scopes) <= self.group_scopes.get(group, set()):
+                return   # everything is already on disk
+            number = self.group_number.get(group)
+            if number is None:
+                number = self.group_number[group] = len(self.groups)
+                self.groups.append(group)
+            self.group_scopes.setdefault(group, set()).update(scopes)
+            if keep:
+                start = len(self.ids)
+                with open(self.matrix_path, "ab") as f:
+                    if f.tell() != start * self._row_bytes:
+                        f.truncate(start * self._row_bytes)   # rows of a write that died before its metadata
+                    f.write(vectors[keep].tobytes())
+                for offset, i in enumerate(keep):
+                    self.row_of[missing[i][0]] = start + offset
+                    self.ids.append(missing[i][0])
+                self.row_group = np.concatenate([self.row_group, np.full(len(keep), number, dtype=np.int32)])
+                self._matrix = None
+            self._save_meta()
+
+    def add_scope(self, group, scope):
+        with self._writing():
+            if group in self.group_scopes and scope not in self.group_scopes[group]:
+                self.group_scopes[group].add(scope)
+                self._save_meta()
+
+    def remove_group(self, group):
+        with self._writing():
+            number = self.group_number.get(group)
+            if number is None or group not in self.group_scopes:
+                return
+            for row in np.nonzero(self.row_group == number)[0].tolist():
+                self.deleted.add(row)
+                if self.row_of.get(self.ids[row]) == row:
+                    del self.row_of[self.ids[row]]
+            self.group_scopes.pop(group, None)
+            self._save_meta()
+
+    def clear(self):
+        with self._writing():
+            self._wipe()
+
+    # --- queries -------------------------------------------------------------
+
+    def search_many(self, queries, scopes, k=5):
+        """Batched cosine top-k: one list of (doc_id, score) per query, best first."""
+        scopes = set(scopes)
+        with self._lock:
+            self._load_meta()
+            matrix = self._mapped()
+            if matrix is None or not queries:
+                return [[] for _ in queries]
+            allowed = [self.group_number[g] for g, s in self.group_scopes.items() if not scopes.isdisjoint(s)]
+            if not allowed:
+                return [[] for _ in queries]
+            mask = np.isin(self.row_group, allowed)
+            if self.deleted:
+                mask[list(self.deleted)] = False
+            ids = self.ids
+
+        q = np.ascontiguousarray(self.embedder(queries), dtype=np.float32)
+        scores = np.empty((len(queries), matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], SEARCH_BLOCK_ROWS):
+            block = matrix[start:start + SEARCH_BLOCK_ROWS]
+            scores[:, start:start + block.shape[0]] = q @ block.T
+        scores[:, ~mask] = -np.inf
+
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return [[] for _ in queries]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for qi in range(len(queries)):
+            rows = top[qi][np.argsort(-scores[qi, top[qi]])]
+            results.append([(ids[r], float(scores[qi, r])) for r in rows if scores[qi, r] > 0])
+        return results
+
+    def search(self, query, scopes, k=5):
+        return self.search_many([query], scopes, k)[0]
+
+    def stats(self):
+        with self._lock:
+            self._load_meta()
+            return {"rows": len(self.ids), "live_rows": len(self.ids) - len(self.deleted), "dim": self.dim,
+                    "embedder": self.embedder_name, "groups": len(self.group_scopes),
+                    "bytes": len(self.ids) * self.dim * 4}
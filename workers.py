@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+
+# ==============================================================================
+#                          BOUNDED BACKGROUND WORKER POOL
+# ==============================================================================
+
+class WorkerPool:
+    """
+    A small fixed-size pool of daemon threads fed by a bounded queue.
+    Used for work that must not sit on the request path (chat titles, ...).
+    submit() never blocks: when the queue is full the job is dropped and
+    False is returned, so callers keep their fallback behaviour.
+    """
+
+    def __init__(self, name, workers=2, max_queue=100):
+        self.name = name
+        self.num_workers = workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "dropped": 0,
+                       "busy": 0, "total_run_s": 0.0, "max_run_s": 0.0, "total_wait_s": 0.0}
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.num_workers):
+                t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self):
+        while True:
+            enqueued_at, fn, args, kwargs = self._queue.get()
+            started = time.time()
+            with self._lock:
+                self._stats["busy"] += 1
+                self._stats["total_wait_s"] += started - enqueued_at
+            ok = True
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                ok = False
+                print(f"❌ [{self.name}] Background job failed: {e}")
+            finally:
+                elapsed = time.time() - started
+                with self._lock:
+                    self._stats["busy"] -= 1
+                    self._stats["completed" if ok else "failed"] += 1
+                    self._stats["total_run_s"] += elapsed
+                    self._stats["max_run_s"] = max(self._stats["max_run_s"], elapsed)
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        self._start()
+        try:
+            self._queue.put_nowait((time.time(), fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            print(f"⚠️ [{self.name}] Queue full, job dropped.")
+            return False
+        with self._lock:
+            self._stats["submitted"] += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            done = self._stats["completed"] + self._stats["failed"]
+            return {
+                "workers": self.num_workers,
+                "queue_depth": self._queue.qsize(),
+                "queue_max": self._queue.maxsize,
+                "busy": self._stats["busy"],
+                "submitted": self._stats["submitted"],
+                "completed": self._stats["completed"],
+                "failed": self._stats["failed"],
+                "dropped": self._stats["dropped"],
+                "avg_wait_ms": round(self._stats["total_wait_s"] / done * 1000, 1) if done else 0.0,
+                "avg_run_ms": round(self._stats["total_run_s"] / done * 1000, 1) if done else 0.0,
+                "max_run_ms": round(self._stats["max_run_s"] * 1000, 1),
+            }